@@ -0,0 +1,15 @@
+"""
+numba 可选加速
+装了 numba 就用 njit 编译热点循环；没装时 njit 退化成原样返回函数，模块照常可用
+"""
+try:
+    from numba import njit
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+    def njit(*args, **kwargs):
+        # 兼容 @njit 和 @njit(cache=True, ...) 两种写法
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda func: func
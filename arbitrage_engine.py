@@ -1,9 +1,42 @@
 import pandas as pd
-import sqlite3
+import numpy as np
 import pytz
 import os
-from datetime import datetime, timedelta
-import config 
+import hashlib
+from datetime import datetime, timedelta, timezone
+import db
+
+# run_analysis 结果缓存目录
+CACHE_DIR = ".cache"
+# 北京时间固定 UTC+8
+CN_OFFSET = timezone(timedelta(hours=8))
+
+def analyze_window(highs, lows, action, lower, upper):
+    """
+    单次扫描行情窗口，返回 (入场下标, 离场下标)，无后续行情时离场下标为 -1
+    价格超出 (lower, upper) 的脏数据在扫描时直接跳过；窗口内没有有效行情返回 None
+    B: 入场 = 最高点，离场 = 其后最低点 (冲高回落)
+    S: 入场 = 最低点，离场 = 其后最高点 (触底反弹)
+    """
+    clean = (lows > lower) & (highs < upper)
+    if not clean.any():
+        return None
+
+    if action == 'B':
+        entry_pos = int(np.argmax(np.where(clean, highs, -np.inf)))
+        tail_clean = clean[entry_pos + 1:]
+        if not tail_clean.any():
+            return entry_pos, -1
+        exit_pos = entry_pos + 1 + int(np.argmin(np.where(tail_clean, lows[entry_pos + 1:], np.inf)))
+    elif action == 'S':
+        entry_pos = int(np.argmin(np.where(clean, lows, np.inf)))
+        tail_clean = clean[entry_pos + 1:]
+        if not tail_clean.any():
+            return entry_pos, -1
+        exit_pos = entry_pos + 1 + int(np.argmax(np.where(tail_clean, highs[entry_pos + 1:], -np.inf)))
+    else:
+        return -1, -1
+    return entry_pos, exit_pos
 
 class ArbitrageEngine:
     def __init__(self):
@@ -14,231 +47,264 @@ class ArbitrageEngine:
         2. 时间维：成交时间 -> 入场间隔 -> 持有时长 -> 离场间隔
         3. 结果维：套利空间%、形态描述
         """
-        self.conn = sqlite3.connect(config.DB_NAME)
+        self.conn = db.open_ro()
         self.tz_cn = pytz.timezone('Asia/Shanghai')
         self.tz_us = pytz.timezone('America/New_York')
         self.bad_tick_threshold = 0.20
+        # ticker -> 整表 2分钟线 (按 Datetime 排序索引)
+        self._cache = {}
+        # 库里已有的分钟线表，一次查出来做集合判断，不再每次读行情都查 sqlite_master
+        self._known_tables = {name for (name,) in self.conn.execute(
+            "SELECT name FROM sqlite_master WHERE type='table' AND name LIKE 'stock_2m_%'"
+        )}
 
     def _convert_time(self, time_str):
         try:
             if isinstance(time_str, pd.Timestamp):
                 return time_str.tz_convert(self.tz_us)
             
-            dt_cn = datetime.strptime(time_str, "%Y/%m/%d %H:%M")
-            dt_cn = self.tz_cn.localize(dt_cn)
-            dt_us = dt_cn.astimezone(self.tz_us)
+            # fromisoformat 是 C 实现，比 strptime 快一个数量级；非补零格式再退回 strptime
+            try:
+                dt_cn = datetime.fromisoformat(time_str.replace('/', '-'))
+            except ValueError:
+                dt_cn = datetime.strptime(time_str, "%Y/%m/%d %H:%M")
+            # 北京时间无夏令时，直接挂固定 +8 偏移
+            dt_us = dt_cn.replace(tzinfo=CN_OFFSET).astimezone(self.tz_us)
             return dt_us
         except:
             return None
 
-    def _calc_duration(self, start, end):
-        """计算时间间隔，返回 +12m 格式"""
-        if not start or not end: return "-"
-        delta = (end - start).total_seconds()
-        if delta < 0: return "+0m"
-        
-        hours, remainder = divmod(delta, 3600)
-        minutes, _ = divmod(remainder, 60)
-        
-        if hours > 0:
-            return f"+{int(hours)}h{int(minutes)}m"
-        else:
-            return f"+{int(minutes)}m"
+    def _convert_times(self, time_series):
+        """
+        批量版 _convert_time：北京时间字符串列 -> 美东时间 (解析失败为 NaT)
+        整列按固定格式向量化解析，不合格式的行 (带秒、用 - 分隔等) 再逐个交给 _convert_time 兜底
+        """
+        dt_cn = pd.to_datetime(time_series, format="%Y/%m/%d %H:%M", errors='coerce')
+        dt_us = dt_cn.dt.tz_localize(self.tz_cn).dt.tz_convert(self.tz_us)
+
+        failed = dt_us.isna() & time_series.notna()
+        if failed.any():
+            fallback = time_series[failed].map(self._convert_time)
+            dt_us[failed] = pd.to_datetime(fallback, utc=True).dt.tz_convert(self.tz_us)
+        return dt_us
+
+    def _format_durations(self, delta_ns):
+        """整列格式化时间间隔 (纳秒)，返回 +12m / +1h5m 格式，缺失值为 -"""
+        delta = pd.Series(delta_ns, dtype='float64')
+        total_minutes = (delta.clip(lower=0) // 60_000_000_000).fillna(0).astype('int64')
+        hours = total_minutes // 60
+        minutes = (total_minutes % 60).astype(str)
+
+        text = np.where(hours > 0, '+' + hours.astype(str) + 'h' + minutes + 'm', '+' + minutes + 'm')
+        return np.where(delta.isna(), '-', text)
 
-    def get_market_data(self, ticker, trade_time):
+    def _read_bars(self, ticker):
+        """读取某只股票的整表 2分钟线，返回按时间排序、美东时区索引的 DataFrame"""
         table_name = f"stock_2m_{ticker.replace('-', '_')}"
-        trade_date_str = trade_time.strftime('%Y-%m-%d')
-        
         try:
-            cursor = self.conn.cursor()
-            cursor.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{table_name}'")
-            if not cursor.fetchone():
+            if table_name not in self._known_tables:
                 return pd.DataFrame()
+            cursor = self.conn.cursor()
 
-            query = f"SELECT * FROM {table_name} WHERE substr(Datetime, 1, 10) = '{trade_date_str}'"
-            df = pd.read_sql(query, self.conn, parse_dates=['Datetime'])
-            
-            if df.empty:
+            # Datetime 是聚簇主键或有索引 (见 StockDataEngine)，按时间排序直接走索引
+            # 分析只用到最高/最低价，只取这两列
+            query = f"SELECT Datetime, High, Low FROM {table_name} ORDER BY Datetime"
+            # 直接 fetchall 成元组再建表，绕开 read_sql 的逐行类型推断
+            rows = cursor.execute(query).fetchall()
+            if not rows:
                 return pd.DataFrame()
+            df = pd.DataFrame.from_records(rows, columns=['Datetime', 'High', 'Low'], coerce_float=True)
+            df['Datetime'] = pd.to_datetime(df['Datetime'], format='ISO8601')
+            # yfinance 价格本身就是 float32 精度，降为 float32 不丢信息，窗口扫描的内存带宽减半
+            df[['High', 'Low']] = df[['High', 'Low']].astype(np.float32)
 
+            # 时区只转换一次
             if df['Datetime'].dt.tz is None:
                 df['Datetime'] = df['Datetime'].dt.tz_localize(self.tz_us)
             else:
                 df['Datetime'] = df['Datetime'].dt.tz_convert(self.tz_us)
-                
-            return df
-        except Exception as e:
+            return df.set_index('Datetime').sort_index()
+        except Exception:
             return pd.DataFrame()
 
-    def run_analysis(self, csv_path, start_date="2025-11-27", window_minutes=30):
+    def _load_ticker(self, ticker):
+        """整表加载某只股票的 2分钟线 (每个 ticker 只查一次库，结果缓存)"""
+        if ticker not in self._cache:
+            self._cache[ticker] = self._read_bars(ticker)
+        return self._cache[ticker]
+
+    def _cache_path(self, csv_path, start_date, window_minutes):
+        """结果缓存文件路径：CSV/数据库 (含 WAL 日志) 的修改时间 + 参数 共同决定缓存键"""
+        key_src = f"{os.path.getmtime(csv_path)}|{start_date}|{window_minutes}|{self.bad_tick_threshold}|{db.get_db_mtime()}"
+        key = hashlib.md5(key_src.encode()).hexdigest()
+        return os.path.join(CACHE_DIR, f"arb_{key}.pkl")
+
+    def run_analysis(self, csv_path, start_date="2025-11-27", window_minutes=30, use_cache=True):
         print(f"🚀 [全能分析引擎] 启动 | 窗口: {window_minutes}分钟 | 起始: {start_date}")
-        
-        df_trades = pd.read_csv(csv_path)
+
+        # 输入没变就直接读上次的结果
+        cache_path = self._cache_path(csv_path, start_date, window_minutes) if use_cache else None
+        if cache_path and os.path.exists(cache_path):
+            print("♻️ 输入未变化，读取缓存结果")
+            return pd.read_pickle(cache_path)
+
+        df_res = self._analyze(csv_path, start_date, window_minutes)
+
+        if cache_path:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            df_res.to_pickle(cache_path)
+        return df_res
+
+    def _analyze(self, csv_path, start_date, window_minutes):
+        # 只读需要的 4 列，并指定类型
+        df_trades = pd.read_csv(
+            csv_path,
+            usecols=['交易标的', '交易方向', '交易价格', '交易时间'],
+            dtype={'交易标的': 'category', '交易方向': 'category', '交易价格': 'float64', '交易时间': 'str'}
+        )
         cutoff_time = self.tz_us.localize(datetime.strptime(start_date, "%Y-%m-%d"))
         
         results = []
 
-        for index, row in df_trades.iterrows():
-            ticker = row['交易标的']
-            action = row['交易方向']
-            price = row['交易价格']
-            time_str = row['交易时间']
-            
-            dt_us = self._convert_time(time_str)
-            if not dt_us or dt_us < cutoff_time:
-                continue
+        # 整列转换时区 + 过滤起始日期 (不再逐行解析)
+        df_trades['_dt_us'] = self._convert_times(df_trades['交易时间'])
+        df_trades = df_trades[df_trades['_dt_us'].notna() & (df_trades['_dt_us'] >= cutoff_time)]
+        # 时间比较统一用 UTC 纳秒 int64，不再走 pandas 时区分派
+        trade_ns_all = df_trades['_dt_us'].dt.as_unit('ns').astype('int64')
+        window_ns = window_minutes * 60_000_000_000
 
-            # 1. 获取行情
-            df_kline = self.get_market_data(ticker, dt_us)
+        # 按标的分组：每个 ticker 只加载一次行情
+        for ticker, df_group in df_trades.groupby('交易标的', sort=False, observed=True):
+            # 1. 获取行情 (整表缓存，按时间排序)
+            df_kline = self._load_ticker(ticker)
             if df_kline.empty:
                 continue
-            
-            # 2. 截取 X分钟 窗口
-            window_end = dt_us + timedelta(minutes=window_minutes)
-            df_window = df_kline[
-                (df_kline['Datetime'] > dt_us) & 
-                (df_kline['Datetime'] <= window_end)
-            ]
-            
-            if df_window.empty:
-                continue
 
-            # 3. 脏数据过滤
-            lower = price * (1 - self.bad_tick_threshold)
-            upper = price * (1 + self.bad_tick_threshold)
-            df_window = df_window[(df_window['Low'] > lower) & (df_window['High'] < upper)]
-            
-            if df_window.empty:
-                continue
+            # 整表列一次性转为 NumPy，窗口只取切片视图
+            all_highs = df_kline['High'].to_numpy()
+            all_lows = df_kline['Low'].to_numpy()
+            all_times_ns = df_kline.index.as_unit('ns').asi8
 
-            # =========================================================
-            # PART A: 顺势波动统计
-            # =========================================================
-            trend_extreme = price
-            trend_pct = 0
-            trend_time_str = "-"
-            trend_wait_str = "-"
-            
-            if action == 'B':
-                # 买入看涨
-                max_idx = df_window['High'].idxmax()
-                trend_extreme = df_window.loc[max_idx]['High']
-                trend_time_obj = df_window.loc[max_idx]['Datetime']
-                if trend_extreme > price:
-                    trend_pct = (trend_extreme - price) / price * 100
-                    trend_time_str = trend_time_obj.strftime('%H:%M')
-                    trend_wait_str = self._calc_duration(dt_us, trend_time_obj)
-            elif action == 'S':
-                # 卖出看跌
-                min_idx = df_window['Low'].idxmin()
-                trend_extreme = df_window.loc[min_idx]['Low']
-                trend_time_obj = df_window.loc[min_idx]['Datetime']
-                if trend_extreme < price:
-                    trend_pct = (price - trend_extreme) / price * 100 
-                    trend_time_str = trend_time_obj.strftime('%H:%M')
-                    trend_wait_str = self._calc_duration(dt_us, trend_time_obj)
-
-            # =========================================================
-            # PART B: 逆势波段套利
-            # =========================================================
-            arb_entry = 0
-            arb_exit = 0
-            arb_pct = 0
-            arb_note = ""
-            
-            # 时间字段
-            entry_time_str = "-"
-            exit_time_str = "-"
-            entry_gap_str = "-" # 入场间隔
-            exit_gap_str = "-"  # 离场间隔
-            hold_str = "-"      # 持仓时长
-
-            if action == 'S': 
-                # 卖出 -> 找地板(Min) -> 找天花板(Max)
-                min_idx = df_window['Low'].idxmin()
-                arb_entry = df_window.loc[min_idx]['Low']
-                entry_time = df_window.loc[min_idx]['Datetime']
-                
-                entry_time_str = entry_time.strftime('%H:%M')
-                entry_gap_str = self._calc_duration(dt_us, entry_time)
-                
-                df_after = df_window[df_window['Datetime'] > entry_time]
-                
-                if not df_after.empty:
-                    max_idx_after = df_after['High'].idxmax()
-                    arb_exit = df_after.loc[max_idx_after]['High']
-                    exit_time = df_after.loc[max_idx_after]['Datetime']
-                    
-                    arb_pct = ((arb_exit - arb_entry) / arb_entry) * 100
-                    arb_note = "触底反弹"
-                    
-                    exit_time_str = exit_time.strftime('%H:%M')
-                    hold_str = self._calc_duration(entry_time, exit_time)
-                    exit_gap_str = self._calc_duration(dt_us, exit_time)
-                else:
-                    arb_exit = arb_entry
-                    arb_note = "单边下跌"
-
-            elif action == 'B':
-                # 买入 -> 找天花板(Max) -> 找地板(Min)
-                max_idx = df_window['High'].idxmax()
-                arb_entry = df_window.loc[max_idx]['High']
-                entry_time = df_window.loc[max_idx]['Datetime']
-                
-                entry_time_str = entry_time.strftime('%H:%M')
-                entry_gap_str = self._calc_duration(dt_us, entry_time)
-                
-                df_after = df_window[df_window['Datetime'] > entry_time]
-                
-                if not df_after.empty:
-                    min_idx_after = df_after['Low'].idxmin()
-                    arb_exit = df_after.loc[min_idx_after]['Low']
-                    exit_time = df_after.loc[min_idx_after]['Datetime']
-                    
-                    arb_pct = ((arb_entry - arb_exit) / arb_entry) * 100
-                    arb_note = "冲高回落"
-                    
-                    exit_time_str = exit_time.strftime('%H:%M')
-                    hold_str = self._calc_duration(entry_time, exit_time)
-                    exit_gap_str = self._calc_duration(dt_us, exit_time)
-                else:
-                    arb_exit = arb_entry
-                    arb_note = "单边上涨"
-
-            # =========================================================
-
-            results.append({
-                '日期': dt_us.strftime('%m-%d'),
-                '标的': ticker,
-                '方向': action,
-                '成交时间': dt_us.strftime('%H:%M'),
-                '成交价': price, # 1. 实际成交价格
+            # 2. 整组一次性二分查找 X分钟 窗口边界 (dt_us < t <= window_end)
+            trade_ns = trade_ns_all.loc[df_group.index].to_numpy()
+            starts = np.searchsorted(all_times_ns, trade_ns, side='right')
+            ends = np.searchsorted(all_times_ns, trade_ns + window_ns, side='right')
+
+            for index, action, price, dt_us, dt_ns, start, end in zip(
+                df_group.index, df_group['交易方向'].to_numpy(), df_group['交易价格'].to_numpy(),
+                df_group['_dt_us'], trade_ns, starts, ends
+            ):
+                if start >= end:
+                    continue
+
+                highs = all_highs[start:end]
+                lows = all_lows[start:end]
+                times_ns = all_times_ns[start:end]
+
+                # 3. 扫描内核 (脏数据过滤在扫描中一并完成)
+                lower = price * (1 - self.bad_tick_threshold)
+                upper = price * (1 + self.bad_tick_threshold)
+                positions = analyze_window(highs, lows, action, lower, upper)
+                if positions is None:
+                    continue
+
+                entry_pos, exit_pos = positions
+                # 极值转回 Python float 再算百分比 (数组是 float32，避免舍入噪声)
+                entry_high, entry_low = float(highs[entry_pos]), float(lows[entry_pos])
+
+                # =========================================================
+                # PART A: 顺势波动统计 (顺势极值点 = 逆势入场点)
+                # =========================================================
+                trend_pct = 0
+
+                if action == 'B' and entry_high > price:
+                    # 买入看涨
+                    trend_pct = (entry_high - price) / price * 100
+                elif action == 'S' and entry_low < price:
+                    # 卖出看跌
+                    trend_pct = (price - entry_low) / price * 100
+
+                # =========================================================
+                # PART B: 逆势波段套利
+                # =========================================================
+                arb_entry = 0
+                arb_exit = 0
+                arb_pct = 0
+                arb_note = ""
+
+                # 时间字段 (纳秒间隔，建表后统一格式化)
+                entry_gap_ns = np.nan # 入场间隔
+                exit_gap_ns = np.nan  # 离场间隔
+                hold_ns = np.nan      # 持仓时长
+
+                if action in ('B', 'S'):
+                    entry_ns = times_ns[entry_pos]
+                    entry_gap_ns = entry_ns - dt_ns
+
+                    if action == 'S':
+                        # 卖出 -> 找地板(Min) -> 找天花板(Max)
+                        arb_entry = entry_low
+                    else:
+                        # 买入 -> 找天花板(Max) -> 找地板(Min)
+                        arb_entry = entry_high
+
+                    if exit_pos >= 0:
+                        exit_ns = times_ns[exit_pos]
+                        if action == 'S':
+                            arb_exit = float(highs[exit_pos])
+                            arb_pct = ((arb_exit - arb_entry) / arb_entry) * 100
+                            arb_note = "触底反弹"
+                        else:
+                            arb_exit = float(lows[exit_pos])
+                            arb_pct = ((arb_entry - arb_exit) / arb_entry) * 100
+                            arb_note = "冲高回落"
+
+                        hold_ns = exit_ns - entry_ns
+                        exit_gap_ns = exit_ns - dt_ns
+                    else:
+                        arb_exit = arb_entry
+                        arb_note = "单边下跌" if action == 'S' else "单边上涨"
+
+                # =========================================================
+
+                results.append({
+                    '日期': dt_us.strftime('%m-%d'),
+                    '标的': ticker,
+                    '方向': action,
+                    '成交时间': dt_us.strftime('%H:%M'),
+                    '成交价': price, # 1. 实际成交价格
                 
-                # 顺势
-                '顺势空间%': round(trend_pct, 2),
+                    # 顺势
+                    '顺势空间%': round(trend_pct, 2),
                 
-                # 逆势套利 - 价格
-                '入场价格': round(arb_entry, 2), # 2. 入场价格
-                '离场价格': round(arb_exit, 2),  # 3. 离场价格
-                '波段套利%': round(arb_pct, 2),
+                    # 逆势套利 - 价格
+                    '入场价格': round(arb_entry, 2), # 2. 入场价格
+                    '离场价格': round(arb_exit, 2),  # 3. 离场价格
+                    '波段套利%': round(arb_pct, 2),
                 
-                # 逆势套利 - 时间
-                '入场间隔': entry_gap_str,
-                '波段持有': hold_str,
-                '离场间隔': exit_gap_str,
+                    # 逆势套利 - 时间
+                    '入场间隔': entry_gap_ns,
+                    '波段持有': hold_ns,
+                    '离场间隔': exit_gap_ns,
                 
-                # 形态
-                '波段形态': arb_note, # 4. 波段形态
+                    # 形态
+                    '波段形态': arb_note, # 4. 波段形态
                 
-                # 辅助排序
-                '_排序时间戳': dt_us 
-            })
+                    # 辅助排序
+                    '_排序时间戳': dt_us,
+                    '_行号': index
+                })
 
         df_res = pd.DataFrame(results)
         
         if not df_res.empty:
+            for col in ['入场间隔', '波段持有', '离场间隔']:
+                df_res[col] = self._format_durations(df_res[col])
+
+            # 先恢复 CSV 原始顺序 (分组遍历会打乱)，再按时间排序
+            df_res = df_res.sort_values(by='_行号')
             df_res = df_res.sort_values(by='_排序时间戳', ascending=False)
-            df_res = df_res.drop(columns=['_排序时间戳'])
+            df_res = df_res.drop(columns=['_排序时间戳', '_行号'])
             
         return df_res
 
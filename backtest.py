@@ -1,58 +1,145 @@
 import pandas as pd
-import sqlite3
+import numpy as np
 import config
+import db
 import matplotlib.pyplot as plt
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+# 离场原因代码 -> 文字
+EXIT_REASONS = ["止损", "止盈", "时间到期"]
+
+def simulate_exits(closes, signals, stop_loss_pct, take_profit_pct, hold_days):
+    """
+    持仓状态机内核 (纯数组运算，不依赖 pandas)
+    :return: (入场下标, 离场下标, 离场原因代码) 三个等长 int 数组，原因代码对应 EXIT_REASONS
+    """
+    n = len(closes)
+    # 每笔交易至少占一天，交易数不会超过 n/2，直接预分配
+    entries = np.empty(n // 2 + 1, dtype=np.int64)
+    exits = np.empty(n // 2 + 1, dtype=np.int64)
+    reasons = np.empty(n // 2 + 1, dtype=np.int8)
+    count = 0
+
+    in_position = False
+    entry_idx = 0
+    entry_price = 0.0
+    days_held = 0
+    
+    # 遍历每一天
+    for i in range(1, n):
+        # --- 如果持有仓位，检查是否卖出 ---
+        if in_position:
+            days_held += 1
+            
+            # 计算当前收益率
+            pct_change = (closes[i] - entry_price) / entry_price
+            
+            if pct_change <= -stop_loss_pct:
+                reason = 0 # 止损
+            elif pct_change >= take_profit_pct:
+                reason = 1 # 止盈
+            elif days_held >= hold_days:
+                reason = 2 # 时间到期
+            else:
+                continue
+            
+            entries[count] = entry_idx
+            exits[count] = i
+            reasons[count] = reason
+            count += 1
+            in_position = False
+            days_held = 0
+
+        # --- 如果空仓，检查是否买入 ---
+        elif signals[i]:
+            in_position = True
+            entry_idx = i
+            entry_price = closes[i]
+            days_held = 0
+
+    return entries[:count], exits[:count], reasons[:count]
+
+def _backtest_worker(tickers, params):
+    """子进程入口：独立连接 (SQLite 连接不能跨进程)，回测一组股票并返回交易日志"""
+    engine = BacktestEngine()
+    try:
+        engine.preload_histories(tickers)
+        for ticker in tickers:
+            engine.run_backtest(ticker, **params)
+        return engine.trade_log
+    finally:
+        engine.conn.close()
 
 class BacktestEngine:
     def __init__(self, initial_capital=100000):
-        self.conn = sqlite3.connect(config.DB_NAME)
+        self.conn = db.open_ro()
         self.initial_capital = initial_capital
         self.balance = initial_capital
         self.positions = {} # 持仓记录
         self.trade_log = [] # 交易日志
+        self.history_cache = {} # ticker -> 历史数据 (preload_histories 批量填充)
+
+    def preload_histories(self, tickers):
+        """UNION ALL 查询批量读取多只股票历史，按 ticker 拆分缓存 (SQLite 单条复合查询最多 500 个 SELECT，分批拼)"""
+        columns = ['Date', 'Close', 'EMA20', 'EMA200']
+        table_cols = db.get_table_columns(self.conn)
+
+        # 去重并保留顺序，只查询库里存在且列齐全的表 (缺列的老表不进预加载，留给 get_history 单独处理)
+        targets = [
+            (ticker, f"stock_{ticker.replace('-', '_')}") for ticker in dict.fromkeys(tickers)
+            if set(columns) <= table_cols.get(f"stock_{ticker.replace('-', '_')}", set())
+        ]
+
+        for start in range(0, len(targets), 500):
+            batch = targets[start:start + 500]
+            query = " UNION ALL ".join(
+                f"SELECT ? AS _ticker, Date, Close, EMA20, EMA200 FROM \"{table_name}\"" for _, table_name in batch
+            ) + " ORDER BY _ticker, Date ASC"
+            params = [ticker for ticker, _ in batch]
+            df_all = pd.read_sql(query, self.conn, params=params, parse_dates=['Date'])
+
+            for ticker, df in df_all.groupby('_ticker', sort=False):
+                self.history_cache[ticker] = df.drop(columns=['_ticker']).reset_index(drop=True)
 
     def get_history(self, ticker):
-        """读取单只股票的完整历史数据"""
+        """读取单只股票的完整历史数据 (优先使用批量预加载的缓存)"""
+        if ticker in self.history_cache:
+            return self.history_cache[ticker]
         try:
             table_name = f"stock_{ticker.replace('-', '_')}"
-            # 按日期正序排列 (旧 -> 新)
-            df = pd.read_sql(f"SELECT * FROM {table_name} ORDER BY Date ASC", self.conn, parse_dates=['Date'])
+            # 按日期正序排列 (旧 -> 新)，只取回测用到的列
+            df = pd.read_sql(f"SELECT Date, Close, EMA20, EMA200 FROM {table_name} ORDER BY Date ASC", self.conn, parse_dates=['Date'])
             return df
         except:
             return pd.DataFrame()
 
     # ====================================================
-    # 策略逻辑定义 (在这里把 strategy.py 的逻辑翻译成单行判断)
+    # 策略逻辑定义 (在这里把 strategy.py 的逻辑翻译成整列信号)
     # ====================================================
-    def strategy_ema_pullback(self, row, prev_row=None):
+    def strategy_ema_pullback(self, df, tolerance=0.015):
         """
-        策略：EMA多头排列 + 回调买入
-        返回: 'BUY', 'SELL', or None
+        策略：EMA多头排列 + 回调买入 (整列向量化，一次算出全部交易日的信号)
+        返回: 与 df 等长的布尔数组，True 代表当天发出买入信号
         """
-        # 1. 必须有数据
-        if row['EMA200'] is None or pd.isna(row['EMA200']):
-            return None
-            
-        close = row['Close']
-        ema20 = row['EMA20']
-        ema60 = row['EMA60']
-        ema200 = row['EMA200']
+        close = df['Close'].to_numpy()
+        ema20 = df['EMA20'].to_numpy()
+        ema200 = df['EMA200'].to_numpy()
+
+        # 1. 必须有数据 (年线未形成的早期数据不发信号)
+        has_data = ~pd.isna(ema200)
 
         # 买入条件
         # A. 大趋势向上 (收盘 > 年线)
         trend_up = close > ema200
         
         # B. 回调触碰 EMA20 (允许 1.5% 误差)
-        tolerance = 0.015
-        touch_ema20 = (ema20 * (1 - tolerance)) <= close <= (ema20 * (1 + tolerance))
+        touch_ema20 = (ema20 * (1 - tolerance) <= close) & (close <= ema20 * (1 + tolerance))
         
         # C. 简单的出场条件 (止盈止损)
         # 这里我们只负责发买入信号，卖出逻辑由引擎统一管理(如持有10天或止损)
         
-        if trend_up and touch_ema20:
-            return 'BUY'
-        
-        return None
+        return has_data & trend_up & touch_ema20
 
     # ====================================================
     # 核心回测循环
@@ -71,97 +158,90 @@ class BacktestEngine:
 
         print(f"🔄 正在回测 {ticker} ({len(df)} 天数据)...")
         
-        in_position = False
-        entry_price = 0
-        entry_date = None
-        days_held = 0
-        
-        # 遍历每一天
-        for i in range(1, len(df)):
-            today = df.iloc[i]
-            yesterday = df.iloc[i-1]
-            current_price = today['Close']
-            date = today['Date']
-
-            # --- 如果持有仓位，检查是否卖出 ---
-            if in_position:
-                days_held += 1
-                
-                # 计算当前收益率
-                pct_change = (current_price - entry_price) / entry_price
-                
-                exit_reason = None
-                if pct_change <= -stop_loss_pct:
-                    exit_reason = "止损"
-                elif pct_change >= take_profit_pct:
-                    exit_reason = "止盈"
-                elif days_held >= hold_days:
-                    exit_reason = "时间到期"
-                
-                if exit_reason:
-                    # 执行卖出
-                    pnl = (current_price - entry_price) # 每股盈亏
-                    return_rate = pnl / entry_price
-                    
-                    self.trade_log.append({
-                        'Ticker': ticker,
-                        'Entry_Date': entry_date,
-                        'Exit_Date': date,
-                        'Entry_Price': entry_price,
-                        'Exit_Price': current_price,
-                        'Reason': exit_reason,
-                        'Return': return_rate
-                    })
-                    
-                    in_position = False
-                    days_held = 0
-
-            # --- 如果空仓，检查是否买入 ---
-            else:
-                signal = self.strategy_ema_pullback(today, yesterday)
-                if signal == 'BUY':
-                    # 执行买入
-                    in_position = True
-                    entry_price = current_price
-                    entry_date = date
-                    days_held = 0
+        # 一次性取出 NumPy 数组，循环内只做整数下标访问 (不再 df.iloc[i])
+        closes = df['Close'].to_numpy()
+
+        # 买入信号整列预计算一次
+        signals = self.strategy_ema_pullback(df)
+
+        # 状态机内核只吃数组，返回 (入场下标, 离场下标, 原因代码) 三个数组
+        entries, exits, reasons = simulate_exits(closes, signals, stop_loss_pct, take_profit_pct, hold_days)
+
+        # 收益率整列算好，再一次性生成交易日志
+        entry_prices = closes[entries]
+        exit_prices = closes[exits]
+        returns = (exit_prices - entry_prices) / entry_prices
+        dates = df['Date'].to_numpy()
+        
+        for k in range(len(entries)):
+            self.trade_log.append({
+                'Ticker': ticker,
+                'Entry_Date': pd.Timestamp(dates[entries[k]]),
+                'Exit_Date': pd.Timestamp(dates[exits[k]]),
+                'Entry_Price': entry_prices[k],
+                'Exit_Price': exit_prices[k],
+                'Reason': EXIT_REASONS[reasons[k]],
+                'Return': returns[k]
+            })
+
+    def run_parallel(self, tickers, n_jobs=None, **params):
+        """
+        多进程并行回测 (各股票之间互不依赖)
+        :param n_jobs: 进程数，默认 CPU 核数
+        :param params: 透传给 run_backtest 的止损/止盈/持仓参数
+        """
+        n_jobs = min(n_jobs or os.cpu_count() or 1, len(tickers))
+        if n_jobs <= 1:
+            self.preload_histories(tickers)
+            for ticker in tickers:
+                self.run_backtest(ticker, **params)
+            return
+
+        # 按顺序切成连续的块，合并后交易日志顺序与串行一致
+        chunk_size = -(-len(tickers) // n_jobs)
+        chunks = [tickers[i:i + chunk_size] for i in range(0, len(tickers), chunk_size)]
+
+        with ProcessPoolExecutor(max_workers=len(chunks)) as pool:
+            for trades in pool.map(_backtest_worker, chunks, [params] * len(chunks)):
+                self.trade_log.extend(trades)
 
     def print_performance(self):
         if not self.trade_log:
             print("⚠️ 期间未触发任何交易。")
             return
 
-        df_trades = pd.DataFrame(self.trade_log)
+        # 收益序列直接转 NumPy，统计全部用数组运算
+        returns = np.fromiter((t['Return'] for t in self.trade_log), dtype=np.float64, count=len(self.trade_log))
         
         # --- 1. 基础统计 ---
-        total_trades = len(df_trades)
-        wins = df_trades[df_trades['Return'] > 0]
-        losses = df_trades[df_trades['Return'] <= 0]
+        total_trades = len(returns)
+        wins = returns[returns > 0]
+        losses = returns[returns <= 0]
         
         # 胜率
         win_rate = len(wins) / total_trades if total_trades > 0 else 0
         
         # 盈亏比 (避免除以0)
-        avg_win = wins['Return'].mean() if not wins.empty else 0
-        avg_loss = abs(losses['Return'].mean()) if not losses.empty else 0
+        avg_win = wins.mean() if len(wins) else 0
+        avg_loss = abs(losses.mean()) if len(losses) else 0
         pl_ratio = avg_win / avg_loss if avg_loss > 0 else 0
         
         # --- 2. 资金曲线与回撤计算 ---
         # 假设每次全仓交易 (复利计算)
-        df_trades['Equity'] = (1 + df_trades['Return']).cumprod() * self.initial_capital
+        equity = np.cumprod(1 + returns) * self.initial_capital
         
         # 计算最大回撤 (Max Drawdown)
         # 累计最大值
-        df_trades['Peak'] = df_trades['Equity'].cummax()
+        peak = np.maximum.accumulate(equity)
         # 当前回撤幅度
-        df_trades['Drawdown'] = (df_trades['Equity'] - df_trades['Peak']) / df_trades['Peak']
-        max_drawdown = df_trades['Drawdown'].min() # 这是一个负数，如 -0.15
+        drawdown = (equity - peak) / peak
+        max_drawdown = drawdown.min() # 这是一个负数，如 -0.15
         
         # --- 3. 夏普比率 (简化估算) ---
         # 这里基于“每笔交易”计算，严格来说应该基于“每日净值”计算
         risk_free_rate = 0.04 # 假设无风险利率 4%
-        mean_return = df_trades['Return'].mean()
-        std_return = df_trades['Return'].std()
+        mean_return = returns.mean()
+        std_return = returns.std(ddof=1) if total_trades > 1 else 0
         
         # 这是一个粗略的每笔交易夏普，年化需要乘以 sqrt(交易频率)
         # 这里仅作参考
@@ -171,8 +251,8 @@ class BacktestEngine:
         print("\n" + "="*50)
         print("📊 全面回测分析报告 (Advanced)")
         print("="*50)
-        print(f"💰 最终资金:   ${df_trades['Equity'].iloc[-1]:.2f} (初始 ${self.initial_capital})")
-        print(f"📈 累计收益:   {(df_trades['Equity'].iloc[-1]/self.initial_capital - 1):.2%}")
+        print(f"💰 最终资金:   ${equity[-1]:.2f} (初始 ${self.initial_capital})")
+        print(f"📈 累计收益:   {(equity[-1]/self.initial_capital - 1):.2%}")
         print("-" * 50)
         print(f"🛡️ 最大回撤:   {max_drawdown:.2%} (最重要风险指标!)")
         print(f"⚖️ 夏普比率:   {sharpe_ratio:.2f}")
@@ -187,14 +267,14 @@ class BacktestEngine:
         
         # 子图1: 资金曲线
         plt.subplot(2, 1, 1)
-        plt.plot(df_trades['Equity'], label='Strategy Equity', color='blue')
+        plt.plot(equity, label='Strategy Equity', color='blue')
         plt.title('Equity Curve (Compound)')
         plt.grid(True)
         
         # 子图2: 回撤曲线
         plt.subplot(2, 1, 2)
-        plt.fill_between(range(len(df_trades)), df_trades['Drawdown'], 0, color='red', alpha=0.3)
-        plt.plot(df_trades['Drawdown'], color='red', label='Drawdown')
+        plt.fill_between(range(len(drawdown)), drawdown, 0, color='red', alpha=0.3)
+        plt.plot(drawdown, color='red', label='Drawdown')
         plt.title('Drawdown (%)')
         plt.grid(True)
         
@@ -219,8 +299,8 @@ if __name__ == "__main__":
     'STX', 'WDC', 'FLNC', 'SMR', 'CIEN', 'COHR', 'UBER', 'HOOD', 'MSTR',
     'CRCL', 'ONDS']
     
-    for t in test_tickers:
-        tester.run_backtest(t, stop_loss_pct=0.08, take_profit_pct=0.15, hold_days=20)
+    # 多进程并行回测 (每个进程一次查询预加载自己负责的股票)
+    tester.run_parallel(test_tickers, stop_loss_pct=0.08, take_profit_pct=0.15, hold_days=20)
         
     # 3. 打印结果
     tester.print_performance()
\ No newline at end of file
@@ -4,6 +4,7 @@ import plotly.graph_objects as go
 from strategy import StrategyRunner
 from data_engine import StockDataEngine
 import config
+import db
 
 # ================= 页面配置 =================
 st.set_page_config(
@@ -12,6 +13,43 @@ st.set_page_config(
     layout="wide"  # 宽屏模式，看表格更舒服
 )
 
+# ================= 数据缓存 =================
+# 读库结果只依赖数据库状态，缓存 5 分钟，页面交互直接命中内存
+@st.cache_data(ttl=300)
+def load_top_gainers(days, top_n):
+    runner = StrategyRunner()
+    try:
+        return runner.run_top_gainers(days=days, top_n=top_n)
+    finally:
+        runner.close()
+
+@st.cache_data(ttl=300)
+def load_ema_pullback():
+    runner = StrategyRunner()
+    try:
+        return runner.run_ema_pullback()
+    finally:
+        runner.close()
+
+@st.cache_data(ttl=300)
+def load_chart_data(ticker, rows=250):
+    """只读画图需要的最近 rows 根 K 线，价格列转 float32，直接给 Plotly 用"""
+    conn = db.open_ro()
+    try:
+        df = pd.read_sql(
+            f"SELECT * FROM \"stock_{ticker.replace('-', '_')}\" ORDER BY Date DESC LIMIT ?", 
+            conn,
+            params=(int(rows),),
+            parse_dates=['Date']
+        )
+    finally:
+        conn.close()
+
+    cols = [c for c in ['Open', 'High', 'Low', 'Close', 'EMA20', 'EMA60', 'EMA200'] if c in df.columns]
+    df = df[['Date'] + cols].iloc[::-1].reset_index(drop=True)
+    df[cols] = df[cols].astype('float32')
+    return df
+
 # ================= 侧边栏：控制区 =================
 st.sidebar.title("🚀 控制台")
 st.sidebar.info("数据源: 本地 SQLite")
@@ -22,6 +60,8 @@ if st.sidebar.button("🔄 立即运行数据更新"):
         engine = StockDataEngine()
         engine.update_all()
         engine.close()
+    # 数据已变，清空读缓存
+    st.cache_data.clear()
     st.sidebar.success("数据更新完毕！请刷新页面。")
 
 # 股票选择器 (用于画图)
@@ -32,16 +72,13 @@ selected_ticker = st.sidebar.selectbox("选择股票查看详情:", config.WATCH
 # ================= 主页面：策略扫描结果 =================
 st.title("📈 SmartTrader AI 量化看板")
 
-# 初始化策略运行器
-runner = StrategyRunner()
-
 # 创建两列布局
 col1, col2 = st.columns(2)
 
 with col1:
     st.subheader("🔥 20日涨幅榜 (Top Gainers)")
     # 获取数据
-    top_gainers = runner.run_top_gainers(days=20, top_n=10)
+    top_gainers = load_top_gainers(days=20, top_n=10)
     if top_gainers:
         df_gainers = pd.DataFrame(top_gainers)
         # 美化表格显示
@@ -60,7 +97,7 @@ with col1:
 
 with col2:
     st.subheader("📉 均线回调监控 (Pullbacks)")
-    pullbacks = runner.run_ema_pullback()
+    pullbacks = load_ema_pullback()
     if pullbacks:
         df_pullback = pd.DataFrame(pullbacks)
         # 只要展示关键信息
@@ -76,60 +113,49 @@ with col2:
     else:
         st.success("今日无回调买入信号，市场强势或处于空头。")
 
-runner.close()
-
 # ================= 下方：交互式 K 线图 =================
 st.markdown("---")
 st.subheader(f"🕯️ {selected_ticker} 技术走势图")
 
-# 获取历史数据用于画图
-engine = StockDataEngine()
-# 直接写 SQL 读全部历史
+# 获取画图数据 (带缓存，只取最近 1 年)
 try:
-    df_hist = pd.read_sql(
-        f"SELECT * FROM stock_{selected_ticker.replace('-', '_')} ORDER BY Date ASC", 
-        engine.conn,
-        parse_dates=['Date']
-    )
-    
-    # 为了画图清晰，只取最近 1 年
-    df_chart = df_hist.tail(250).reset_index(drop=True)
+    df_chart = load_chart_data(selected_ticker, rows=250)
+    dates = df_chart['Date'].to_numpy()
 
     # 使用 Plotly 画专业的 K 线图
     fig = go.Figure()
 
-    # 1. 画 K 线
+    # 1. 画 K 线 (直接传 NumPy 数组，跳过 pandas 序列化)
     fig.add_trace(go.Candlestick(
-        x=df_chart['Date'],
-        open=df_chart['Open'],
-        high=df_chart['High'],
-        low=df_chart['Low'],
-        close=df_chart['Close'],
+        x=dates,
+        open=df_chart['Open'].to_numpy(),
+        high=df_chart['High'].to_numpy(),
+        low=df_chart['Low'].to_numpy(),
+        close=df_chart['Close'].to_numpy(),
         name='K Line'
     ))
 
-    # 2. 画均线 (EMA20 黄色, EMA60 蓝色)
+    # 2. 画均线 (EMA20 黄色, EMA60 蓝色)，用 WebGL 渲染
     if 'EMA20' in df_chart.columns:
-        fig.add_trace(go.Scatter(x=df_chart['Date'], y=df_chart['EMA20'], mode='lines', name='EMA20', line=dict(color='orange', width=1)))
+        fig.add_trace(go.Scattergl(x=dates, y=df_chart['EMA20'].to_numpy(), mode='lines', name='EMA20', line=dict(color='orange', width=1)))
     
     if 'EMA60' in df_chart.columns:
-        fig.add_trace(go.Scatter(x=df_chart['Date'], y=df_chart['EMA60'], mode='lines', name='EMA60', line=dict(color='blue', width=1)))
+        fig.add_trace(go.Scattergl(x=dates, y=df_chart['EMA60'].to_numpy(), mode='lines', name='EMA60', line=dict(color='blue', width=1)))
         
     if 'EMA200' in df_chart.columns:
-        fig.add_trace(go.Scatter(x=df_chart['Date'], y=df_chart['EMA200'], mode='lines', name='EMA200', line=dict(color='purple', width=2)))
+        fig.add_trace(go.Scattergl(x=dates, y=df_chart['EMA200'].to_numpy(), mode='lines', name='EMA200', line=dict(color='purple', width=2)))
 
     # 设置布局：去掉周末空缺，增加滑动条
     fig.update_layout(
         xaxis_rangeslider_visible=False,
         height=600,
         title=f"{selected_ticker} Price vs EMA",
-        template="plotly_dark" # 暗黑模式，很专业
+        template="plotly_dark", # 暗黑模式，很专业
+        uirevision=selected_ticker # 同一只股票重跑时保留缩放/平移状态
     )
 
     # 显示图表
     st.plotly_chart(fig, use_container_width=True)
 
 except Exception as e:
-    st.error(f"无法读取 {selected_ticker} 的数据，请先运行数据更新。错误: {e}")
-
-engine.close()
\ No newline at end of file
+    st.error(f"无法读取 {selected_ticker} 的数据，请先运行数据更新。错误: {e}")
\ No newline at end of file
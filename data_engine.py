@@ -1,9 +1,13 @@
 import yfinance as yf
 import pandas as pd
-import sqlite3
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 import os
-import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import config  # 直接引用同目录下的 config.py
+import db
+from _njit import njit, HAS_NUMBA
 
 # ==========================================
 # 代理设置 (按需开启，如果不需要请注释掉)
@@ -12,10 +16,128 @@ proxy = "http://127.0.0.1:7890"
 os.environ['HTTP_PROXY'] = proxy
 os.environ['HTTPS_PROXY'] = proxy
 
+EMA_SPANS = [5, 10, 20, 60, 120, 200]
+EMA_COLS = [f'EMA{span}' for span in EMA_SPANS]
+RETURN_SPANS = [5, 10, 20, 60, 120, 200]
+# 平滑系数只算一次，避免每只股票重复构造
+EMA_ALPHAS = 2.0 / (np.array(EMA_SPANS, dtype=np.float64) + 1.0)
+ATR_ALPHAS = np.array([1 / 14])  # Wilder 平滑
+KDJ_ALPHAS = np.array([1 / 3])   # K、D 的 1/3 平滑
+
+# 同时在途的下载请求上限 (代替逐只 sleep 的温和限流)
+_DOWNLOAD_SLOTS = threading.Semaphore(4)
+
+@njit(cache=True)
+def _ewma_kernel(close, alphas):
+    """
+    单次遍历同时推进 k 条 EMA (adjust=False)，返回 (n, k) 矩阵；遇到 NaN 沿用上一个值
+    (不开 fastmath：它假设没有 NaN，会把 x == x 的判断优化掉)
+    """
+    n = close.shape[0]
+    k = alphas.shape[0]
+    out = np.empty((n, k))
+    state = np.empty(k)
+    for j in range(k):
+        state[j] = close[0]
+        out[0, j] = close[0]
+    for i in range(1, n):
+        x = close[i]
+        for j in range(k):
+            if x == x:
+                state[j] = alphas[j] * x + (1.0 - alphas[j]) * state[j]
+            out[i, j] = state[j]
+    return out
+
+def ewma_multi(close, alphas):
+    """多条 EMA 一次算完：有 numba 走 JIT 内核，没有就退回 pandas 逐列 ewm (纯 Python 循环反而更慢)"""
+    close = np.asarray(close, dtype=np.float64)
+    alphas = np.asarray(alphas, dtype=np.float64)
+    if HAS_NUMBA:
+        return _ewma_kernel(close, alphas)
+    s = pd.Series(close)
+    return np.column_stack([s.ewm(alpha=a, adjust=False).mean().to_numpy() for a in alphas])
+
+@njit(cache=True)
+def _macd_kernel(close, a_fast, a_slow, a_signal):
+    """快慢线、DIF、DEA、柱子在同一次遍历里算完，不生成中间序列 (同样不开 fastmath，靠 x == x 跳过缺失值)"""
+    n = close.shape[0]
+    out = np.empty((n, 3))
+    fast = close[0]
+    slow = close[0]
+    dea = 0.0
+    for i in range(n):
+        x = close[i]
+        if i > 0 and x == x:
+            fast = a_fast * x + (1.0 - a_fast) * fast
+            slow = a_slow * x + (1.0 - a_slow) * slow
+        dif = fast - slow
+        dea = dif if i == 0 else a_signal * dif + (1.0 - a_signal) * dea
+        out[i, 0] = dif
+        out[i, 1] = dea
+        out[i, 2] = (dif - dea) * 2
+    return out
+
+def macd(close, fast=12, slow=26, signal=9):
+    """返回 (n, 3) 矩阵: MACD, MACD_Signal, MACD_Hist (柱子按国内习惯 ×2)"""
+    close = np.asarray(close, dtype=np.float64)
+    a_fast, a_slow, a_signal = 2.0 / (fast + 1), 2.0 / (slow + 1), 2.0 / (signal + 1)
+    if HAS_NUMBA:
+        return _macd_kernel(close, a_fast, a_slow, a_signal)
+    ema = ewma_multi(close, [a_fast, a_slow])
+    dif = ema[:, 0] - ema[:, 1]
+    dea = ewma_multi(dif, [a_signal])[:, 0]
+    return np.column_stack([dif, dea, (dif - dea) * 2])
+
+@njit(cache=True)
+def _rsi_kernel(close, alpha):
+    """
+    RSI 单次遍历：涨跌幅拆分 + 两条平滑在同一个循环里完成
+    与 ewm(alpha, adjust=True) 等价：两条均线分母相同，相除后约掉，只需累加带衰减的分子
+    (不开 fastmath：这里要靠 NaN/0 的显式分支)
+    """
+    n = close.shape[0]
+    out = np.full(n, np.nan)
+    decay = 1.0 - alpha
+    gain_sum = 0.0
+    loss_sum = 0.0
+    for i in range(1, n):
+        delta = close[i] - close[i - 1]
+        if delta != delta:
+            # 缺失值：权重照常衰减，RSI 沿用上一个值
+            gain_sum *= decay
+            loss_sum *= decay
+            out[i] = out[i - 1]
+            continue
+        gain_sum = (delta if delta > 0 else 0.0) + decay * gain_sum
+        loss_sum = (-delta if delta < 0 else 0.0) + decay * loss_sum
+        if loss_sum > 0:
+            out[i] = 100.0 - 100.0 / (1.0 + gain_sum / loss_sum)
+        elif gain_sum > 0:
+            out[i] = 100.0
+    return out
+
+def rsi(close, period=14):
+    """RSI (平滑系数 1/period)；没有 numba 时退回 pandas ewm"""
+    close = np.asarray(close, dtype=np.float64)
+    if HAS_NUMBA:
+        return _rsi_kernel(close, 1.0 / period)
+    delta = pd.Series(close).diff()
+    gain = delta.clip(lower=0).ewm(alpha=1.0 / period).mean()
+    loss = (-delta.clip(upper=0)).ewm(alpha=1.0 / period).mean()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (100 - 100 / (1 + gain / loss)).to_numpy()
+
+def _rolling(values, window, reducer, **kwargs):
+    """滑动窗口聚合 (等价 rolling(window).xxx()，前 window-1 行为 NaN)，窗口是视图不复制数据"""
+    out = np.full(len(values), np.nan)
+    if len(values) >= window:
+        out[window - 1:] = reducer(sliding_window_view(values, window), axis=1, **kwargs)
+    return out
+
 class StockDataEngine:
     def __init__(self):
-        # 使用 config.DB_NAME 连接数据库
-        self.conn = sqlite3.connect(config.DB_NAME)
+        # 使用 config.DB_NAME 连接数据库 (WAL + synchronous=NORMAL，批量写入少 fsync)
+        self.conn = db.open_rw()
 
     def _flatten_columns(self, df):
         """处理 yfinance 的 MultiIndex 列名 (Price, Ticker) -> Price"""
@@ -27,13 +149,12 @@ class StockDataEngine:
         """获取数据库中某张表的最晚时间戳"""
         try:
             cursor = self.conn.cursor()
-            cursor.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{table_name}'")
+            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (table_name,))
             if not cursor.fetchone():
                 return None
             
-            query = f"SELECT MAX(Datetime) FROM {table_name}"
-            result = pd.read_sql(query, self.conn)
-            last_time = result.iloc[0, 0]
+            # 单个标量直接从游标取，不绕 pandas 建 DataFrame (Datetime 有索引/主键，MAX 只读一页)
+            last_time = cursor.execute(f'SELECT MAX(Datetime) FROM "{table_name}"').fetchone()[0]
             
             if last_time:
                 return pd.to_datetime(last_time)
@@ -41,14 +162,171 @@ class StockDataEngine:
         except Exception:
             return None
 
+    def _create_minute_table(self, table_name):
+        """
+        新收录的分钟线建成以 Datetime 为主键的 WITHOUT ROWID 聚簇表:
+        行按时间物理有序存放，按时间范围读是顺序扫描，也省掉一份独立索引的空间
+        """
+        self.conn.execute(f'DROP TABLE IF EXISTS "{table_name}"')
+        self.conn.execute(f'''
+            CREATE TABLE "{table_name}" (
+                Datetime TEXT PRIMARY KEY,
+                Close REAL, High REAL, Low REAL, Open REAL,
+                Volume INTEGER, Ticker TEXT
+            ) WITHOUT ROWID
+        ''')
+
+    def _insert_minute_rows(self, table_name, df):
+        """分钟线写入：预编译的 INSERT OR REPLACE + executemany，整批一个事务 (不走 to_sql)"""
+        cols = list(df.columns)
+        col_sql = ", ".join(f'"{c}"' for c in cols)
+        placeholders = ", ".join("?" * len(cols))
+        # 时间转成与 to_sql 一致的文本格式 (如 2025-10-31 13:30:00+00:00)
+        rows = list(df.assign(Datetime=df['Datetime'].astype(str)).itertuples(index=False, name=None))
+        with self.conn:
+            self.conn.executemany(f'INSERT OR REPLACE INTO "{table_name}" ({col_sql}) VALUES ({placeholders})', rows)
+
+    def _write_daily_table(self, table_name, df):
+        """
+        日线整表重写：建表语句用 pandas 的 get_schema 生成 (和 to_sql 建出来的表结构一致)，数据走 executemany
+        不用 to_sql 是因为它每次调用都会自己 commit，没法放进 update_all 的整批事务
+        """
+        self.conn.execute(f'DROP TABLE IF EXISTS "{table_name}"')
+        self.conn.execute(pd.io.sql.get_schema(df, table_name, con=self.conn))
+
+        # 写入格式和 to_sql 一致：时间存 'YYYY-MM-DD HH:MM:SS' 文本，NaN 存 NULL
+        data = df.astype(object).where(df.notna(), None)
+        for col in df.select_dtypes(include=['datetime', 'datetimetz']).columns:
+            data[col] = data[col].map(lambda v: None if v is None else v.isoformat(' '))
+        col_sql = ", ".join(f'"{c}"' for c in df.columns)
+        placeholders = ", ".join("?" * len(df.columns))
+        self.conn.executemany(f'INSERT INTO "{table_name}" ({col_sql}) VALUES ({placeholders})',
+                              data.itertuples(index=False, name=None))
+
+    def _ensure_date_index(self, table_name):
+        """
+        给日线表的 Date 建倒序索引：扫描器都是 ORDER BY Date DESC LIMIT k，有索引直接按索引取前 k 行，不用全表排序
+        整表重写 (DROP + CREATE) 会连索引一起删掉，所以每次写表后都要补
+        这里不提交：在 update_all 的显式事务里执行，和日线数据一起提交或回滚
+        """
+        self.conn.execute(f'CREATE INDEX IF NOT EXISTS "idx_{table_name}_Date" ON "{table_name}" (Date DESC)')
+
+    def refresh_latest_snapshot(self):
+        """
+        重建 latest_snapshot 宽表：每张日线表的最新一行存成一行 (TableName 为表名，该表没有的列为 NULL)
+        扫描器读"最新一行"时直接查这一张表，不用逐表查询
+        先建到 latest_snapshot_new，再在同一事务里删旧表、改名换上，读者只会看到完整的旧快照或新快照
+        update_all 里调用时跟着日线的整批事务一起提交；单独调用时自己开事务
+        """
+        own_tx = not self.conn.in_transaction
+        if own_tx:
+            self.conn.execute("BEGIN")
+        try:
+            table_cols = {}
+            for table, col in self.conn.execute("""
+                SELECT m.name, p.name FROM sqlite_master AS m, pragma_table_info(m.name) AS p
+                WHERE m.type='table' AND m.name LIKE 'stock_%'
+            """):
+                table_cols.setdefault(table, []).append(col)
+            table_cols = {t: cols for t, cols in table_cols.items() if 'Date' in cols}
+            columns = list(dict.fromkeys(c for cols in table_cols.values() for c in cols))
+
+            # 列不声明类型，保留原表的存储类型 (REAL/INTEGER/TEXT)，读出来和查原表一致
+            col_sql = ", ".join(f'"{c}"' for c in columns)
+            self.conn.execute('DROP TABLE IF EXISTS latest_snapshot_new')
+            self.conn.execute(f'CREATE TABLE latest_snapshot_new (TableName TEXT, {col_sql})')
+            for table, cols in table_cols.items():
+                select_cols = ", ".join(f'"{c}"' if c in cols else 'NULL' for c in columns)
+                self.conn.execute(f'INSERT INTO latest_snapshot_new SELECT \'{table}\', {select_cols} FROM "{table}" ORDER BY Date DESC LIMIT 1')
+            self.conn.execute('DROP TABLE IF EXISTS latest_snapshot')
+            self.conn.execute('ALTER TABLE latest_snapshot_new RENAME TO latest_snapshot')
+            if own_tx:
+                self.conn.commit()
+        except Exception:
+            if own_tx:
+                self.conn.rollback()
+            raise
+
+    def _daily_unchanged(self, table_name, df):
+        """
+        库里这张日线表和刚下载的是否一致 (行数、最后日期、最后收盘都相同)
+        一致就说明没有新 K 线 (同日重跑/周末)，不必重算指标、重写整表
+        """
+        try:
+            count, last_date, last_close = self.conn.execute(
+                f'SELECT (SELECT COUNT(*) FROM "{table_name}"), Date, Close FROM "{table_name}" ORDER BY Date DESC LIMIT 1'
+            ).fetchone()
+        except Exception:
+            return False
+        if not last_date or count != len(df):
+            return False
+        return pd.Timestamp(last_date) == df.index[-1] and np.isclose(last_close, df['Close'].iloc[-1])
+
     def _calculate_indicators(self, df):
-        """日线指标计算 (仅用于 update_all)"""
+        """
+        日线指标计算 (仅用于 update_all)
+        价格列只转一次 NumPy，所有指标都在数组上算好放进一个 dict，最后一次性拼回 df
+        """
         if len(df) < 2: return df
-        # 简单示例，如需完整指标请把之前的代码贴回来
-        for span in [5, 10, 20, 60, 120, 200]:
-            df[f'EMA{span}'] = df['Close'].ewm(span=span, adjust=False).mean()
+        close = df['Close'].to_numpy(dtype=float)
+        high = df['High'].to_numpy(dtype=float)
+        low = df['Low'].to_numpy(dtype=float)
+        volume = df['Volume'].to_numpy(dtype=float)
+        out = {}
+
+        # 所有 EMA 走同一个内核，一次遍历 Close 全部算完
+        ema = ewma_multi(close, EMA_ALPHAS)
+        for j, col in enumerate(EMA_COLS):
+            out[col] = ema[:, j]
+
+        # N 日涨跌幅 (与 pct_change(N) 相同，前 N 行为 NaN)，扫描器的涨幅榜/强势股直接读这几列
+        for span in RETURN_SPANS:
+            ret = np.full(len(close), np.nan)
+            ret[span:] = close[span:] / close[:-span] - 1
+            out[f'Return_{span}d'] = ret
+
+        # MACD 三列同样一次遍历得出
+        macd_out = macd(close)
+        out['MACD'] = macd_out[:, 0]
+        out['MACD_Signal'] = macd_out[:, 1]
+        out['MACD_Hist'] = macd_out[:, 2]
+
+        # RSI (14)
+        out['RSI'] = rsi(close)
+
+        # 布林带 (20日, 2倍样本标准差)
+        bbm = _rolling(close, 20, np.mean)
+        bb_std = _rolling(close, 20, np.std, ddof=1)
+        out['BBM'] = bbm
+        out['BBU'] = bbm + 2 * bb_std
+        out['BBL'] = bbm - 2 * bb_std
+
+        # ATR: 真实波幅直接在一维数组上逐元素取最大 (fmax 忽略首行前收盘的 NaN)，再走 EMA 内核做 Wilder 平滑
+        prev_close = np.empty_like(close)
+        prev_close[0] = np.nan
+        prev_close[1:] = close[:-1]
+        tr = np.fmax.reduce([high - low, np.abs(high - prev_close), np.abs(low - prev_close)])
+        out['ATR'] = ewma_multi(tr, ATR_ALPHAS)[:, 0]
+
+        # KDJ (9,3,3): RSV 用 9日最高/最低，K、D 为 1/3 平滑
+        low_min = _rolling(low, 9, np.min)
+        high_max = _rolling(high, 9, np.max)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rsv = np.nan_to_num((close - low_min) / (high_max - low_min) * 100, nan=0.0)
+        k = ewma_multi(rsv, KDJ_ALPHAS)[:, 0]
+        d = ewma_multi(k, KDJ_ALPHAS)[:, 0]
+        out['K'] = k
+        out['D'] = d
+        out['J'] = 3 * k - 2 * d
+
+        # OBV: 涨日加量、跌日减量，np.sign 向量化 (首行 diff 为 NaN 记 0)
+        direction = np.nan_to_num(np.sign(np.diff(close, prepend=np.nan)))
+        out['OBV'] = (direction * volume).cumsum()
         # ... 其他指标逻辑 ...
-        return df
+
+        # 先堆成一整块连续的 float64 矩阵 (DataFrame 内部就是单个 block)，再一次拼接，代替逐列 df[col] = ... 反复插列
+        indicators = pd.DataFrame(np.column_stack(list(out.values())), index=df.index, columns=list(out))
+        return pd.concat([df, indicators], axis=1)
 
     def update_all(self):
         """
@@ -62,30 +340,90 @@ class StockDataEngine:
             
             if all_data.empty: return
 
-            for ticker in config.WATCHLIST:
-                try:
-                    if ticker not in all_data.columns.levels[0]: continue
-                    df = all_data[ticker].copy()
-                    if df.empty: continue
-                    
-                    df = df[df['Volume'] > 0].copy()
-                    df = self._flatten_columns(df)
-                    
-                    # 日线我们通常需要计算指标
-                    df = self._calculate_indicators(df) 
-                    
-                    df.reset_index(inplace=True)
-                    df['Ticker'] = ticker
-                    df.columns = [str(c).replace(' ', '_') for c in df.columns]
-                    
-                    table_name = f"stock_{ticker.replace('-', '_')}"
-                    df.to_sql(table_name, self.conn, if_exists='replace', index=False)
-                except:
-                    continue
+            # 整批一个显式事务：日线表和快照表一起提交，中途出错整批回滚
+            # 单只股票出错只回滚到它自己的保存点，报出来后继续下一只
+            self.conn.execute("BEGIN")
+            try:
+                for ticker in config.WATCHLIST:
+                    self.conn.execute("SAVEPOINT daily_ticker")
+                    try:
+                        self._update_daily_ticker(ticker, all_data)
+                    except Exception as e:
+                        self.conn.execute("ROLLBACK TO daily_ticker")
+                        print(f"⚠️ {ticker} 日线更新失败，已跳过: {e}")
+                    self.conn.execute("RELEASE daily_ticker")
+
+                # 日线写完，同一事务里重建最新一行快照表
+                self.refresh_latest_snapshot()
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
             print("✅ 日线数据更新完成！")
         except Exception as e:
             print(f"❌ 批量下载严重错误: {e}")
 
+    def _update_daily_ticker(self, ticker, all_data):
+        """单只股票：从批量下载结果里取出日线，有新 K 线就重算指标、整表重写 (在 update_all 的事务里执行)"""
+        if ticker not in all_data.columns.levels[0]: return
+        df = all_data[ticker]
+        if df.empty: return
+
+        # 绝大多数日子都有成交，只有确实存在停牌/缺失行时才切片 (指标列是新建的，不必整表 copy)
+        traded = df['Volume'] > 0
+        if not traded.all():
+            df = df.loc[traded]
+        df = self._flatten_columns(df)
+
+        table_name = f"stock_{ticker.replace('-', '_')}"
+        if self._daily_unchanged(table_name, df):
+            self._ensure_date_index(table_name)
+            return
+
+        # 日线我们通常需要计算指标；算完直接链式整理成入库格式，不留中间副本
+        df = (
+            df.pipe(self._calculate_indicators)
+              .reset_index()
+              .assign(Ticker=ticker)
+              .rename(columns=lambda c: str(c).replace(' ', '_'))
+        )
+
+        self._write_daily_table(table_name, df)
+        self._ensure_date_index(table_name)
+
+    def _fetch_and_stage(self, ticker, is_new_stock):
+        """
+        [线程池任务] 只做下载 + 清洗，不碰数据库
+        新股票下载 60天 (yfinance 2m 最多回溯 60天)，老股票回看 5天 (防周末/漏跑)
+        """
+        download_period = "60d" if is_new_stock else "5d"
+
+        # yf.download 内部用全局字典收结果，多线程并发会串数据，这里改用 Ticker.history
+        with _DOWNLOAD_SLOTS:
+            df = yf.Ticker(ticker).history(period=download_period, interval="2m", auto_adjust=True)
+
+        if df.empty:
+            return None
+
+        # 数据清洗：只留与库表一致的行情列，时间统一成 UTC (与 yf.download 入库格式一致)
+        df = self._flatten_columns(df)
+        df = df.loc[df['Volume'] > 0, ['Close', 'High', 'Low', 'Open', 'Volume']]
+        if df.index.tz is not None:
+            df.index = df.index.tz_convert('UTC')
+
+        # 格式化
+        df = df.reset_index()
+        df['Ticker'] = ticker
+
+        # 统一时间列名
+        if 'Date' in df.columns:
+            df.rename(columns={'Date': 'Datetime'}, inplace=True)
+        elif 'index' in df.columns:
+            df.rename(columns={'index': 'Datetime'}, inplace=True)
+
+        df.columns = [str(c).replace(' ', '_') for c in df.columns]
+        return df
+
     def update_minute_data(self, target_tickers=None):
         """
         [2分钟级智能更新]
@@ -98,76 +436,57 @@ class StockDataEngine:
             download_list = target_tickers
 
         print(f"⏱️ [2分钟线更新] 准备扫描 {len(download_list)} 只股票...")
-        
+
+        # 先在主线程查好每只股票的库内最新时间 (sqlite 连接不能跨线程用)
+        last_times = {}
         for ticker in download_list:
             # 🔥 改动1: 表名变成 stock_2m_
             table_name = f"stock_2m_{ticker.replace('-', '_')}"
-            
-            try:
-                last_db_time = self.get_db_last_timestamp(table_name)
-                
-                # 🔥 改动2: 动态周期选择
-                if last_db_time is None:
-                    # Case A: 新股票
-                    # yfinance 2m 数据最多支持回溯 60天，我们直接拉满
-                    download_period = "60d" 
-                    is_new_stock = True
-                else:
-                    # Case B: 老股票
-                    # 为了防止周末漏数据，或者你隔了几天没跑，每次更新回看 5天
-                    # 这样比 1d 安全，比 60d 快得多
-                    download_period = "5d" 
-                    is_new_stock = False
-
-                # 🔥 改动3: interval="2m"
-                # print(f"   Downloading {ticker} (2m, {download_period})...")
-                df = yf.download(ticker, period=download_period, interval="2m", auto_adjust=True, progress=False)
-                
-                if df.empty:
-                    print(f"   ⚠️ {ticker} 暂无数据")
-                    continue
-
-                # 数据清洗
-                df = self._flatten_columns(df)
-                df = df[df['Volume'] > 0].copy()
-                
-                # 格式化
-                df.reset_index(inplace=True)
-                df['Ticker'] = ticker
-                
-                # 统一时间列名
-                if 'Date' in df.columns:
-                    df.rename(columns={'Date': 'Datetime'}, inplace=True)
-                elif 'index' in df.columns:
-                     df.rename(columns={'index': 'Datetime'}, inplace=True)
-                
-                df.columns = [str(c).replace(' ', '_') for c in df.columns]
-
-                # 入库逻辑
-                if is_new_stock:
-                    print(f"   📝 [新收录] {ticker}: 下载60天(2m) -> 写入 {len(df)} 条")
-                    df.to_sql(table_name, self.conn, if_exists='replace', index=False)
-                else:
-                    # 增量更新：先确保时区对齐
-                    if df['Datetime'].dt.tz is not None and last_db_time.tzinfo is None:
-                        last_db_time = last_db_time.tz_localize(df['Datetime'].dt.tz)
-                    
-                    # 只保留比数据库新的数据
-                    new_data = df[df['Datetime'] > last_db_time].copy()
-                    
-                    if not new_data.empty:
-                        print(f"   ➕ [更新] {ticker}: 追加 {len(new_data)} 条新数据")
-                        new_data.to_sql(table_name, self.conn, if_exists='append', index=False)
+            last_times[ticker] = self.get_db_last_timestamp(table_name)
+
+        # 下载纯网络 I/O，交给线程池并发；入库仍在主线程串行完成
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            futures = {
+                pool.submit(self._fetch_and_stage, ticker, last_times[ticker] is None): ticker
+                for ticker in download_list
+            }
+            for future in as_completed(futures):
+                ticker = futures[future]
+                table_name = f"stock_2m_{ticker.replace('-', '_')}"
+                last_db_time = last_times[ticker]
+
+                try:
+                    df = future.result()
+                    if df is None:
+                        print(f"   ⚠️ {ticker} 暂无数据")
+                        continue
+
+                    # 入库逻辑
+                    if last_db_time is None:
+                        print(f"   📝 [新收录] {ticker}: 下载60天(2m) -> 写入 {len(df)} 条")
+                        self._create_minute_table(table_name)
+                        self._insert_minute_rows(table_name, df)
                     else:
-                        # 这种情况很正常（比如盘前刚跑过一次，或者今天休市）
-                        pass
-
-                # 稍微限流，防止请求过快
-                time.sleep(0.2) 
-                
-            except Exception as e:
-                print(f"❌ {ticker} 更新失败: {e}")
-        
+                        # 增量更新：先确保时区对齐
+                        if df['Datetime'].dt.tz is not None and last_db_time.tzinfo is None:
+                            last_db_time = last_db_time.tz_localize(df['Datetime'].dt.tz)
+
+                        # 只保留比数据库新的数据
+                        new_data = df[df['Datetime'] > last_db_time].copy()
+
+                        if not new_data.empty:
+                            print(f"   ➕ [更新] {ticker}: 追加 {len(new_data)} 条新数据")
+                            self._insert_minute_rows(table_name, new_data)
+                        else:
+                            # 这种情况很正常（比如盘前刚跑过一次，或者今天休市）
+                            pass
+
+                    # 按时间范围查询/排序走索引 (老表也顺带补建)
+                    db.ensure_datetime_index(self.conn, table_name)
+
+                except Exception as e:
+                    print(f"❌ {ticker} 更新失败: {e}")
+
         print("✅ 所有 2分钟线 更新完成！")
 
     def close(self):
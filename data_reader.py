@@ -1,8 +1,8 @@
-import sqlite3 
 import pandas as pd
+import db
 
-# 1. 连接数据库
-conn = sqlite3.connect('stock_data.db')
+# 1. 连接数据库 (只读连接，带 mmap/大缓存的读优化)
+conn = db.open_ro()
 
 # 2. 构造查询语句 (SQL)
 # 假设我们要读 NVDA 的数据，表名通常是 stock_NVDA
@@ -10,8 +10,9 @@ ticker = "NVDA"
 table_name = f"stock_{ticker}" 
 
 # 3. 读取数据
-# parse_dates=['Date'] 的作用是把字符串格式的日期自动转回时间格式
-df = pd.read_sql(f"SELECT * FROM {table_name}", conn, parse_dates=['Date'])
+# 日期列是固定的 ISO 格式文本，读出后用 pd.to_datetime 一次性向量化转回时间格式 (比 parse_dates 逐行推断快)
+df = pd.read_sql(f"SELECT * FROM {table_name}", conn)
+df['Date'] = pd.to_datetime(df['Date'], format='ISO8601')
 
 # 4. 打印看看
 print(f"成功读取 {len(df)} 行数据")
@@ -0,0 +1,110 @@
+import sqlite3
+from pathlib import Path
+import config
+
+# 只读分析连接的 PRAGMA：内存映射读取 + 大页缓存 + 临时表放内存
+READ_PRAGMAS = [
+    "PRAGMA mmap_size=1073741824",  # 1GB 内存映射，直接从系统页缓存读页
+    "PRAGMA cache_size=-262144",    # 256MB 页缓存 (负数单位为 KB)
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA query_only=1",
+]
+
+# 扫描时每张表都有自己的查询语句 (表名不能参数化)，默认 128 条的语句缓存装不下全市场，放大到 1024
+CACHED_STATEMENTS = 1024
+
+# 写入连接 (数据更新) 的 PRAGMA：WAL 下提交只追加日志，synchronous=NORMAL 不再每次提交都 fsync
+WRITE_PRAGMAS = [
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-65536",     # 64MB 页缓存
+]
+
+def open_ro(db_name=None, check_same_thread=True):
+    """打开只读数据库连接 (回测/分析/扫描等只读场景使用)
+    WAL 是库文件级属性，由写入连接 open_rw 开启后对只读连接同样生效"""
+    db_path = Path(db_name or config.DB_NAME).resolve()
+    conn = sqlite3.connect(f"{db_path.as_uri()}?mode=ro", uri=True, check_same_thread=check_same_thread,
+                           cached_statements=CACHED_STATEMENTS)
+    for pragma in READ_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+def open_rw(db_name=None):
+    """打开读写数据库连接 (数据下载入库使用)"""
+    conn = sqlite3.connect(db_name or config.DB_NAME)
+    for pragma in WRITE_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+def get_db_mtime(db_name=None):
+    """
+    库的最后修改时间：取库文件和 WAL 日志里较新的一个
+    WAL 模式下新写入先落在 -wal 文件，主库文件要等检查点才会变，只看主库会把旧缓存当成有效
+    """
+    db_path = Path(db_name or config.DB_NAME)
+    files = [db_path, db_path.with_name(db_path.name + "-wal")]
+    return max(f.stat().st_mtime for f in files if f.exists())
+
+_shared_conns = {}
+
+def get_conn(db_name=None):
+    """
+    进程内共享的只读连接 (每个库文件只打开一次，check_same_thread=False 可以给线程池用)
+    多个扫描器连续运行时不再各自建连接、跑 PRAGMA；被外部关掉了就重新打开
+    """
+    db_path = str(Path(db_name or config.DB_NAME).resolve())
+    conn = _shared_conns.get(db_path)
+    if conn is not None:
+        try:
+            conn.execute("SELECT 1")
+            return conn
+        except sqlite3.ProgrammingError:
+            pass
+    conn = _shared_conns[db_path] = open_ro(db_path, check_same_thread=False)
+    return conn
+
+# 库文件绝对路径 -> (schema_version, 各表列名)；按库文件而不是连接对象缓存，新开的连接也能命中，也不会把连接一直留在缓存里
+_table_columns_cache = {}
+
+def _read_stock_table_columns(conn):
+    rows = conn.execute("""
+        SELECT m.name, p.name FROM sqlite_master AS m, pragma_table_info(m.name) AS p
+        WHERE m.type='table' AND m.name LIKE 'stock_%'
+    """).fetchall()
+    table_cols = {}
+    for table, col in rows:
+        table_cols.setdefault(table, []).append(col)
+    return tuple((table, frozenset(cols)) for table, cols in table_cols.items())
+
+def get_table_columns(conn=None):
+    """
+    所有股票表的列名 {表名: {列名...}}，按 sqlite_master 顺序
+    以 (库文件路径, schema_version) 为缓存键：建表/删表/改表都会让它变化，结构没变时不再查元数据
+    内存库和事务进行中 (结构改动可能回滚) 的连接不走缓存
+    """
+    conn = conn or get_conn()
+    db_path = conn.execute("PRAGMA database_list").fetchone()[2]
+    schema_version = conn.execute("PRAGMA schema_version").fetchone()[0]
+    cacheable = bool(db_path) and not conn.in_transaction
+    cached = _table_columns_cache.get(db_path) if cacheable else None
+    if cached is not None and cached[0] == schema_version:
+        table_cols = cached[1]
+    else:
+        table_cols = _read_stock_table_columns(conn)
+        if cacheable:
+            _table_columns_cache[db_path] = (schema_version, table_cols)
+    return {table: set(cols) for table, cols in table_cols}
+
+def get_tables(conn=None):
+    """所有股票表名 (缓存规则同 get_table_columns)"""
+    return list(get_table_columns(conn))
+
+def ensure_datetime_index(conn, table_name):
+    """给老的分钟线表 (rowid 表) 的 Datetime 建索引；聚簇表主键本身就是 Datetime，不用再建"""
+    row = conn.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name=?", (table_name,)).fetchone()
+    if row and 'WITHOUT ROWID' in row[0].upper():
+        return
+    conn.execute(f'CREATE INDEX IF NOT EXISTS "idx_{table_name}_Datetime" ON "{table_name}" (Datetime)')
+    conn.commit()
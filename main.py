@@ -1,5 +1,5 @@
 from data_engine import StockDataEngine
-from strategy import StrategyRunner, MarketPhaseScanner, ReversalScanner, TrendlineScanner, HighWinRateScanner
+from strategy import StrategyRunner, MarketPhaseScanner, ReversalScanner, TrendlineScanner, HighWinRateScanner, PriceCache
 import config
 
 def main():
@@ -7,8 +7,11 @@ def main():
     engine = StockDataEngine()
     engine.update_all() 
 
-    # 2. 初始化策略运行器
-    runner = StrategyRunner()
+    # 2. 预读全市场最近 60 天行情，MACD+KDJ / 超短线反转 / 高胜率超跌三个扫描共用，不再各自查库
+    price_cache = PriceCache.load_all(days=60)
+
+    # 初始化策略运行器
+    runner = StrategyRunner(price_cache)
     
     # === 运行策略 A: 找涨幅榜 ===
     top_gainers = runner.run_top_gainers(days=20, top_n=10)
@@ -87,7 +90,7 @@ def main():
     phase_scanner.close()
 
     # === 运行策略 G: 底部反转启动 ===
-    rev_scanner = ReversalScanner()
+    rev_scanner = ReversalScanner(price_cache)
     # 调用新的短线方法
     short_reversals = rev_scanner.run_short_term_reversal()
     
@@ -98,7 +101,7 @@ def main():
         for item in short_reversals:
             print(f"   {item['Ticker']:<6} | ${item['Close']:<9.2f} | {item['Detail']}")
 
-    rev_scanner.conn.close()
+    rev_scanner.close()
     
     # === 运行策略 ===
     scanner = TrendlineScanner()
@@ -116,7 +119,7 @@ def main():
             print(f"   {item['Ticker']:<6} | {item['Duration']}天     | {price_info:<18} | {points}")
 
     # === 运行策略 L: 高胜率超跌 ===
-    hw_scanner = HighWinRateScanner()
+    hw_scanner = HighWinRateScanner(price_cache)
     opportunities = hw_scanner.run()
     
     if opportunities:
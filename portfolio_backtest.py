@@ -1,16 +1,20 @@
 import pandas as pd
-import sqlite3
 import config
+import db
 import matplotlib.pyplot as plt
 import numpy as np
 import yfinance as yf
+import os
+import time
+
+CACHE_DIR = ".cache"
+SPY_CACHE_TTL = 24 * 3600  # 日线一天最多变一次，缓存 24 小时
 
 class PortfolioBacktestPro:
     def __init__(self, initial_capital=100000):
-        self.conn = sqlite3.connect(config.DB_NAME)
+        self.conn = db.open_ro()
         self.cash = initial_capital
         self.initial_capital = initial_capital
-        self.positions = {} 
         self.trade_log = []
         self.history_equity = []
         
@@ -18,17 +22,39 @@ class PortfolioBacktestPro:
         self.risk_per_trade = 0.015  # 每笔交易最大亏损风险 (1.5%)
         self.atr_multiplier = 2.5    # 止损宽度 (2.5倍 ATR)
 
+    def _get_spy_cached(self, period="2y"):
+        """SPY 日线落盘缓存 (24 小时内重复回测不再联网)"""
+        cache_path = os.path.join(CACHE_DIR, f"spy_{period}.pkl")
+        if os.path.exists(cache_path) and time.time() - os.path.getmtime(cache_path) < SPY_CACHE_TTL:
+            return pd.read_pickle(cache_path)
+
+        spy = yf.download("SPY", period=period, interval="1d", auto_adjust=True, progress=False)
+        if isinstance(spy.columns, pd.MultiIndex):
+            spy.columns = spy.columns.get_level_values(0)
+        if not spy.empty:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            spy.to_pickle(cache_path)
+        return spy
+
     def load_data_and_benchmark(self):
         """加载个股数据 + 大盘指数(SPY)"""
         print("⏳ 正在加载个股数据...")
         self.market_data = {}
         all_dates = set()
         
-        # 1. 加载个股
+        # 1. 加载个股 (先查一次库里各表的列，缺表/缺列的直接跳过；所有股票共用一个游标)
+        columns = ['Date', 'Close', 'EMA20', 'EMA60', 'RSI', 'ATR']
+        table_cols = db.get_table_columns(self.conn)
+        cursor = self.conn.cursor()
         for ticker in config.WATCHLIST:
+            table_name = f"stock_{ticker.replace('-', '_')}"
+            if not set(columns) <= table_cols.get(table_name, set()):
+                continue
             try:
-                table_name = f"stock_{ticker.replace('-', '_')}"
-                df = pd.read_sql(f"SELECT * FROM {table_name} ORDER BY Date ASC", self.conn, parse_dates=['Date'])
+                # 只取回测用到的列，日期按固定 ISO 格式一次性向量化解析
+                rows = cursor.execute(f'SELECT Date, Close, EMA20, EMA60, RSI, ATR FROM "{table_name}" ORDER BY Date ASC').fetchall()
+                df = pd.DataFrame.from_records(rows, columns=columns)
+                df['Date'] = pd.to_datetime(df['Date'], format='ISO8601')
                 if not df.empty:
                     df.set_index('Date', inplace=True)
                     self.market_data[ticker] = df
@@ -37,101 +63,103 @@ class PortfolioBacktestPro:
             
         # 2. 临时下载 SPY 大盘数据作为“红绿灯”
         print("🚦 正在获取 SPY 大盘数据用于风控...")
-        self.spy = yf.download("SPY", period="2y", interval="1d", auto_adjust=True, progress=False)
-        if isinstance(self.spy.columns, pd.MultiIndex):
-            self.spy.columns = self.spy.columns.get_level_values(0)
+        self.spy = self._get_spy_cached()
         self.spy['MA200'] = self.spy['Close'].rolling(200).mean()
         
         self.timeline = sorted(list(all_dates))
 
-    def get_spy_trend(self, date):
-        """判断大盘环境: True=牛市(可开仓), False=熊市(只卖不买)"""
-        if date not in self.spy.index:
-            # 如果对应日期没有SPY数据(比如假期差异)，往前找最近的一天
-            try:
-                idx = self.spy.index.get_indexer([date], method='pad')[0]
-                row = self.spy.iloc[idx]
-            except:
-                return True # 默认允许
-        else:
-            row = self.spy.loc[date]
-            
-        # 只有当 SPY > 200日均线时，才允许做多
-        if pd.notna(row['MA200']) and row['Close'] < row['MA200']:
-            return False
-        return True
+        # 3. 按统一时间轴对齐成 (日期 × 股票) 的二维矩阵，回测循环里按下标取值，不再逐日 df.loc 构造 Series
+        self.master_dates = pd.DatetimeIndex(self.timeline)
+        self.tickers = list(self.market_data)
+        self.ticker_idx = {ticker: j for j, ticker in enumerate(self.tickers)}
+        shape = (len(self.master_dates), len(self.tickers))
+        self.mats = {}
+        for col in ['Close', 'EMA20', 'EMA60', 'RSI', 'ATR']:
+            mat = np.full(shape, np.nan)
+            for j, ticker in enumerate(self.tickers):
+                mat[:, j] = self.market_data[ticker][col].reindex(self.master_dates).to_numpy(dtype=float)
+            self.mats[col] = mat
+        self.has_data_mat = np.zeros(shape, dtype=bool)
+        for j, ticker in enumerate(self.tickers):
+            self.has_data_mat[:, j] = self.master_dates.isin(self.market_data[ticker].index)
+
+        # 持仓也按股票下标存成数组 (SoA)：空仓时 in_pos 为 False
+        n_tickers = len(self.tickers)
+        self.in_pos = np.zeros(n_tickers, dtype=bool)
+        self.pos_qty = np.zeros(n_tickers)
+        self.pos_entry = np.zeros(n_tickers)
+        self.pos_stop = np.zeros(n_tickers)
+        self.pos_day = np.zeros(n_tickers, dtype=np.int64)  # 开仓日下标，卖出时按开仓先后处理
+
+        # 4. 大盘红绿灯逐日预先算好: True=牛市(可开仓), False=熊市(只卖不买)
+        #    只有当 SPY 跌破 200日均线时才禁止做多 (MA200 为空时允许)；
+        #    SPY 缺当天数据(比如假期差异)就沿用最近一个交易日
+        self.is_bull_arr = np.ones(len(self.master_dates), dtype=bool)
+        if not self.spy.empty:
+            spy_bull = ~(self.spy['Close'] < self.spy['MA200']).to_numpy()
+            self.is_bull_arr = spy_bull[self.spy.index.get_indexer(self.master_dates, method='pad')]
 
     def run(self):
         self.load_data_and_benchmark()
         print("🚀 开始 Pro 版回测 (含大盘风控 + ATR仓位管理)...")
         
-        for date in self.timeline:
-            daily_portfolio_value = self.cash
-            
+        close_mat, ema20_mat, ema60_mat = self.mats['Close'], self.mats['EMA20'], self.mats['EMA60']
+        rsi_mat, atr_mat = self.mats['RSI'], self.mats['ATR']
+
+        for i, date in enumerate(self.timeline):
             # 1. 处理持仓 (卖出逻辑)
-            for ticker in list(self.positions.keys()):
-                df = self.market_data.get(ticker)
-                if date not in df.index: continue
-                row = df.loc[date]
-                pos = self.positions[ticker]
-                
-                price = row['Close']
-                daily_portfolio_value += pos['qty'] * price
-                
-                # --- 止损逻辑 (基于 ATR 的硬止损) ---
-                # 如果价格跌破了我们开仓时设定的止损价
-                if price < pos['stop_loss_price']:
-                    self.cash += pos['qty'] * price
-                    pnl = (price - pos['entry_price']) / pos['entry_price']
-                    self.trade_log.append({'Date':date, 'Ticker':ticker, 'Action':'SELL', 'Reason':'ATR止损', 'PnL':pnl})
-                    del self.positions[ticker]
-                    continue
-                
-                # --- 移动止盈 (Trailing Stop) ---
-                # 如果从持仓后的最高点回撤超过 3倍 ATR (或者固定比例)，也卖出
-                # 这里简单演示：价格涨破均线后又跌破 EMA20
-                if price < row['EMA20'] and price > pos['entry_price']:
-                     self.cash += pos['qty'] * price
-                     pnl = (price - pos['entry_price']) / pos['entry_price']
-                     self.trade_log.append({'Date':date, 'Ticker':ticker, 'Action':'SELL', 'Reason':'趋势止盈', 'PnL':pnl})
-                     del self.positions[ticker]
+            # 当天有行情的持仓按收盘价估值 (停牌/缺数据的持仓当天不计入)
+            prices = close_mat[i]
+            held = self.in_pos & self.has_data_mat[i]
+            daily_portfolio_value = self.cash + float(np.dot(self.pos_qty[held], prices[held]))
+
+            # --- 止损逻辑 (基于 ATR 的硬止损) ---
+            # 如果价格跌破了我们开仓时设定的止损价
+            stop_hit = held & (prices < self.pos_stop)
+            # --- 移动止盈 (Trailing Stop) ---
+            # 如果从持仓后的最高点回撤超过 3倍 ATR (或者固定比例)，也卖出
+            # 这里简单演示：价格涨破均线后又跌破 EMA20
+            trail_hit = held & ~stop_hit & (prices < ema20_mat[i]) & (prices > self.pos_entry)
+
+            to_sell = np.flatnonzero(stop_hit | trail_hit)
+            for j in to_sell[np.lexsort((to_sell, self.pos_day[to_sell]))]:
+                price = prices[j]
+                self.cash += self.pos_qty[j] * price
+                pnl = (price - self.pos_entry[j]) / self.pos_entry[j]
+                reason = 'ATR止损' if stop_hit[j] else '趋势止盈'
+                self.trade_log.append({'Date':date, 'Ticker':self.tickers[j], 'Action':'SELL', 'Reason':reason, 'PnL':pnl})
+                self.in_pos[j] = False
+                self.pos_qty[j] = 0.0
 
             # 2. 开仓逻辑 (买入)
             # 【风控核心】先看大盘脸色！
-            is_bull_market = self.get_spy_trend(date)
-            
-            if is_bull_market: 
-                for ticker in self.market_data:
-                    if ticker in self.positions: continue
+            if self.is_bull_arr[i]: 
+                # 策略：EMA多头排列 + RSI回调，整行向量化筛出当天的候选，只对少数命中的股票逐个下单
+                signal = self.has_data_mat[i] & (close_mat[i] > ema60_mat[i]) & (rsi_mat[i] < 55) & ~self.in_pos
+                for j in np.flatnonzero(signal):
+                    ticker = self.tickers[j]
+                    close = close_mat[i, j]
+                    # 【仓位管理核心】根据 ATR 计算买多少股
+                    # 我们希望这笔交易最多只亏损总账户的 1.5%
+                    atr = atr_mat[i, j] if pd.notna(atr_mat[i, j]) else close*0.02
                     
-                    df = self.market_data.get(ticker)
-                    if date not in df.index: continue
-                    row = df.loc[date]
+                    risk_amount = daily_portfolio_value * self.risk_per_trade # 比如 10万 * 1.5% = 1500元风险预算
+                    stop_loss_dist = atr * self.atr_multiplier # 止损距离 = 2.5 * ATR
                     
-                    # 策略：EMA多头排列 + RSI回调
-                    if (row['Close'] > row['EMA60']) and (row['RSI'] < 55):
-                        
-                        # 【仓位管理核心】根据 ATR 计算买多少股
-                        # 我们希望这笔交易最多只亏损总账户的 1.5%
-                        atr = row['ATR'] if pd.notna(row.get('ATR')) else row['Close']*0.02
-                        
-                        risk_amount = daily_portfolio_value * self.risk_per_trade # 比如 10万 * 1.5% = 1500元风险预算
-                        stop_loss_dist = atr * self.atr_multiplier # 止损距离 = 2.5 * ATR
-                        
-                        # 应该买的股数 = 风险预算 / 每股止损距离
-                        # 例如：风险1500元，每股止损30元，那就买 50股
-                        shares_to_buy = risk_amount / stop_loss_dist
-                        
-                        # 必须有足够的现金
-                        cost = shares_to_buy * row['Close']
-                        if self.cash >= cost and cost > 500:
-                            self.cash -= cost
-                            self.positions[ticker] = {
-                                'qty': shares_to_buy,
-                                'entry_price': row['Close'],
-                                'stop_loss_price': row['Close'] - stop_loss_dist # 记录固定的止损价
-                            }
-                            self.trade_log.append({'Date':date, 'Ticker':ticker, 'Action':'BUY', 'Reason':'Trend+ATR', 'PnL':0})
+                    # 应该买的股数 = 风险预算 / 每股止损距离
+                    # 例如：风险1500元，每股止损30元，那就买 50股
+                    shares_to_buy = risk_amount / stop_loss_dist
+                    
+                    # 必须有足够的现金
+                    cost = shares_to_buy * close
+                    if self.cash >= cost and cost > 500:
+                        self.cash -= cost
+                        self.in_pos[j] = True
+                        self.pos_qty[j] = shares_to_buy
+                        self.pos_entry[j] = close
+                        self.pos_stop[j] = close - stop_loss_dist # 记录固定的止损价
+                        self.pos_day[j] = i
+                        self.trade_log.append({'Date':date, 'Ticker':ticker, 'Action':'BUY', 'Reason':'Trend+ATR', 'PnL':0})
 
             self.history_equity.append({'Date': date, 'Total_Equity': daily_portfolio_value})
 
@@ -149,17 +177,13 @@ class PortfolioBacktestPro:
             df_eq['Drawdown'] = (df_eq['Total_Equity'] - df_eq['Peak']) / df_eq['Peak']
             
             # 2. 获取基准数据 (SPY) 用于对比
-            print("📥 下载基准指数 (SPY) 进行对比...")
+            print("📥 读取基准指数 (SPY) 进行对比...")
             try:
                 start_date = df_eq.index[0]
                 end_date = df_eq.index[-1]
                 
-                # 下载 SPY
-                spy = yf.download("SPY", start=start_date, end=end_date, progress=False, auto_adjust=True)
-                
-                # 修复多层索引问题 (同之前的 Fix)
-                if isinstance(spy.columns, pd.MultiIndex):
-                    spy.columns = spy.columns.get_level_values(0)
+                # 直接复用 run() 时已加载的 SPY，截取回测区间 [start, end)，不再重复下载
+                spy = self.spy.loc[(self.spy.index >= start_date) & (self.spy.index < end_date), ['Close']].copy()
                 
                 # 计算 SPY 累积收益率 (归一化，让它和策略同一天从 0% 起跑)
                 # 逻辑: (今天收盘 / 第一天收盘) - 1
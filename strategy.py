@@ -1,32 +1,356 @@
 import pandas as pd
 import numpy as np
+import os
 import sqlite3
-import config
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import db
 import yfinance as yf
-from scipy.signal import argrelextrema
+from _njit import njit, HAS_NUMBA
+
+MARKET_CAP_CACHE_TTL = 24 * 3600  # 市值一天内变化不大，缓存 24 小时
+# 市值缓存单独放一个小库，扫描器对行情主库保持只读 (不跟日线更新抢写锁)
+CACHE_DIR = ".cache"
+MARKET_CAP_CACHE_DB = os.path.join(CACHE_DIR, "market_cap_cache.db")
+MARKET_CAP_FETCH_WORKERS = 16     # 市值联网查询的并发数 (每只股票一次 HTTP 请求，瓶颈是网络延迟)
+
+# PriceCache 预读的列 (反转 / 高胜率 / MACD+KDJ 三个扫描用到的全部列)
+PRICE_CACHE_COLUMNS = ['Ticker', 'Close', 'High', 'Low', 'EMA5', 'EMA10', 'RSI', 'ATR', 'MACD', 'MACD_Signal', 'K', 'D']
+
+def _read_recent(conn, table, limit):
+    """
+    读取某张表最近 limit 行，按日期正序返回 (倒序取最新 limit 行后在 SQL 里翻回正序，Python 端不用再反转)
+    直接用游标 fetchall 组 DataFrame，跳过 pd.read_sql 的封装层，列和类型与 read_sql 结果一致
+    LIMIT 走 ? 参数，每张表的 SQL 文本固定，重复扫描时直接复用连接里缓存的预编译语句
+    """
+    cursor = conn.execute(f"SELECT * FROM (SELECT * FROM {table} ORDER BY Date DESC LIMIT ?) ORDER BY Date ASC", (int(limit),))
+    columns = [desc[0] for desc in cursor.description]
+    return pd.DataFrame.from_records(cursor.fetchall(), columns=columns, coerce_float=True)
+
+def _snapshot_is_fresh(conn, tables, snapshot_dates):
+    """快照里每张表的 Date 都等于该表当前的 MAX(Date) 才算最新 (Date 有索引，MAX 只读一页；500 张表一批)"""
+    for start in range(0, len(tables), 500):
+        query = " UNION ALL ".join(f'SELECT \'{table}\', MAX(Date) FROM "{table}"' for table in tables[start:start + 500])
+        for table, last_date in conn.execute(query):
+            if snapshot_dates.get(table) != last_date:
+                return False
+    return True
+
+def _read_latest_snapshot(conn, columns, tables):
+    """
+    从 latest_snapshot 宽表 (日线更新时重建) 读各表最新一行，按 tables 顺序返回
+    快照表不存在、缺列、没覆盖全部表 (旧库) 或落后于日线表时返回 None，由调用方退回逐表 UNION 查询
+    """
+    snapshot_cols = {row[1] for row in conn.execute("PRAGMA table_info(latest_snapshot)")}
+    if not snapshot_cols or not set(columns) | {'Date'} <= snapshot_cols:
+        return None
+    col_sql = ", ".join(f'"{c}"' for c in columns)
+    df = pd.read_sql(f'SELECT TableName AS __tbl, {col_sql} FROM latest_snapshot', conn).set_index('__tbl')
+    if not set(tables) <= set(df.index):
+        return None
+    # 日线表在快照之后被改写过 (快照重建失败、别的程序写库) 时快照就过期了，不能当"最新一行"用
+    if not _snapshot_is_fresh(conn, tables, dict(conn.execute('SELECT TableName, Date FROM latest_snapshot'))):
+        return None
+    return df.loc[tables].reset_index()
+
+def _get_latest_frame(conn, columns, table_cols=None, rows=1, count_limit=None):
+    """
+    把所有日线表的最新 rows 行一次性查出来 (代替逐表读取)
+    只要最新一行时优先读 latest_snapshot 快照表，否则用 UNION ALL 拼一条查询
+    返回 DataFrame，__tbl 列为表名，每张表的行按日期倒序连续排列，表里没有的列填 NULL
+    count_limit 不为空时多返回 __n 列：该表行数 (最多数到 count_limit)
+    """
+    if table_cols is None:
+        table_cols = {t: cols for t, cols in db.get_table_columns(conn).items() if 'Date' in cols}
+    tables = list(table_cols)
+    if rows == 1 and count_limit is None and tables:
+        snapshot = _read_latest_snapshot(conn, columns, tables)
+        if snapshot is not None:
+            return snapshot
+    frames = []
+    # SQLite 单条复合查询最多 500 个 SELECT，分批拼
+    for start in range(0, len(tables), 500):
+        parts = []
+        for table in tables[start:start + 500]:
+            select_cols = ", ".join(f'"{c}"' if c in table_cols[table] else f'NULL AS "{c}"' for c in columns)
+            if count_limit is not None:
+                select_cols += f', (SELECT COUNT(*) FROM (SELECT 1 FROM "{table}" LIMIT {int(count_limit)})) AS __n'
+            parts.append(f"""SELECT * FROM (SELECT '{table}' AS __tbl, {select_cols} FROM "{table}" ORDER BY Date DESC LIMIT {int(rows)})""")
+        frames.append(pd.read_sql(" UNION ALL ".join(parts), conn))
+    if not frames:
+        return pd.DataFrame(columns=['__tbl'] + list(columns) + (['__n'] if count_limit is not None else []))
+    return pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+
+def _read_recent_arrays(conn, table, limit, columns, cache=None):
+    """
+    读取某张表最近 limit 行的指定列 (按日期正序)，返回 (行数, {列名: 值})
+    只查需要的列，游标直接拿元组按列拆开，数值列转 float 数组 (NULL -> NaN)，Ticker 保留原始元组
+    LIMIT 同样走 ? 参数 (见 _read_recent)
+    传入 PriceCache 且覆盖所需天数和列时直接从内存切片，不再查库
+    """
+    if cache is not None and cache.covers(limit, columns):
+        return cache.read_recent(table, limit, columns)
+    rows = conn.execute(
+        f"SELECT * FROM (SELECT Date, {', '.join(columns)} FROM {table} ORDER BY Date DESC LIMIT ?) ORDER BY Date ASC",
+        (int(limit),)
+    ).fetchall()
+    data = dict(zip(['Date'] + list(columns), zip(*rows)))
+    for col in columns:
+        if col != 'Ticker':
+            data[col] = np.array(data[col], dtype=float)
+    return len(rows), data
+
+class PriceCache:
+    """
+    全市场最近 days 天行情的内存缓存：一条 UNION ALL 查询读完，反转 / 高胜率 / MACD+KDJ 扫描共用
+    连着跑多个扫描时不再各自逐表查一遍重叠的数据
+    """
+    def __init__(self, days=60, conn=None):
+        self.days = days
+        self.conn = conn or db.get_conn()
+        self.data = {} # {表名: (行数, {列名: 值})}，格式同 _read_recent_arrays
+
+    @classmethod
+    def load_all(cls, days=60, conn=None):
+        cache = cls(days, conn)
+        cache.load()
+        return cache
+
+    def load(self):
+        print(f"📦 [数据缓存] 预读全市场最近 {self.days} 天行情...")
+        table_cols = {t: cols for t, cols in db.get_table_columns(self.conn).items() if 'Date' in cols}
+        tables = list(table_cols)
+        columns = ['Date'] + PRICE_CACHE_COLUMNS
+        self.data = {}
+        # SQLite 单条复合查询最多 500 个 SELECT，分批拼；每张表的行按日期倒序连续排列
+        for start in range(0, len(tables), 500):
+            parts = []
+            for table in tables[start:start + 500]:
+                select_cols = ", ".join(f'"{c}"' if c in table_cols[table] else f'NULL AS "{c}"' for c in columns)
+                parts.append(f"""SELECT * FROM (SELECT '{table}' AS __tbl, {select_cols} FROM "{table}" ORDER BY Date DESC LIMIT {int(self.days)})""")
+            rows = self.conn.execute(" UNION ALL ".join(parts)).fetchall()
+
+            start_row = 0
+            while start_row < len(rows):
+                table = rows[start_row][0]
+                end_row = start_row
+                while end_row < len(rows) and rows[end_row][0] == table:
+                    end_row += 1
+                values = dict(zip(['__tbl'] + columns, zip(*rows[start_row:end_row][::-1]))) # 翻回正序
+                start_row = end_row
+                try:
+                    data = {'Date': values['Date']}
+                    for col in PRICE_CACHE_COLUMNS:
+                        if col not in table_cols[table]: continue # 表里没有的列不进缓存，读取时报错，同查库
+                        data[col] = values[col] if col == 'Ticker' else np.array(values[col], dtype=float)
+                except Exception:
+                    continue # 数据有问题的表不进缓存，扫描时跳过，同查库出错
+                self.data[table] = (len(data['Date']), data)
+        return self
+
+    def covers(self, limit, columns):
+        """缓存是否够用：天数不超过预读天数，列都在预读范围内"""
+        return limit <= self.days and set(columns) <= set(PRICE_CACHE_COLUMNS)
+
+    def read_recent(self, table, limit, columns):
+        """从缓存切出某张表最近 limit 行的指定列，表或列不存在时抛 KeyError"""
+        n, data = self.data[table]
+        start = max(n - int(limit), 0)
+        return n - start, {col: data[col][start:] for col in ['Date'] + list(columns)}
+
+@njit(cache=True)
+def _local_max_kernel(a, order):
+    """
+    局部高点 (numba 编译)：a[i] 严格大于左右各 order 个点才算波峰
+    越界的邻居取端点值 (与 scipy argrelextrema 的 clip 模式一致，所以首尾两点永远不是波峰)
+    """
+    n = len(a)
+    out = np.empty(n, np.int64)
+    count = 0
+    for i in range(n):
+        is_peak = True
+        for k in range(1, order + 1):
+            left = a[max(i - k, 0)]
+            right = a[min(i + k, n - 1)]
+            if not (a[i] > left and a[i] > right):
+                is_peak = False
+                break
+        if is_peak:
+            out[count] = i
+            count += 1
+    return out[:count]
+
+def _local_max_numpy(a, order):
+    """同 _local_max_kernel，没有 numba 时用整段比较"""
+    n = len(a)
+    idx = np.arange(n)
+    is_peak = np.ones(n, dtype=bool)
+    for k in range(1, order + 1):
+        is_peak &= a > a[np.maximum(idx - k, 0)]
+        is_peak &= a > a[np.minimum(idx + k, n - 1)]
+    return np.flatnonzero(is_peak)
+
+def find_peaks(a, order):
+    """寻找局部高点的下标 (代替 argrelextrema(a, np.greater, order=order)[0])"""
+    if HAS_NUMBA:
+        return _local_max_kernel(a, order)
+    return _local_max_numpy(a, order)
+
+@njit(cache=True)
+def _trendline_kernel(highs, peaks, cur, close_now, threshold, min_dist):
+    """
+    趋势线锚点搜索的标量循环版 (numba 编译)，天花板测试逐点计数，不分配临时数组
+    按 (A, B) 波峰对的遍历顺序返回第一条被突破的下降趋势线，A 越早持续天数越长，所以第一条就是最长的
+    先做 O(1) 的突破判定，今天没突破的线直接跳过，逐日的天花板测试只留给候选线，违规超标立即停止计数
+    没有突破返回 (-1, -1)
+    """
+    n_peaks = len(peaks)
+    for i in range(n_peaks):
+        idx_a = peaks[i]
+        if (cur - idx_a) < 30: continue
+        price_a = highs[idx_a]
+        for j in range(i + 1, n_peaks):
+            idx_b = peaks[j]
+            price_b = highs[idx_b]
+            if (idx_b - idx_a) < min_dist: continue
+            if price_b >= price_a: continue # 下降趋势
+            slope = (price_b - price_a) / (idx_b - idx_a)
+            intercept = price_a - slope * idx_a
+            n_check = cur - idx_a - 1
+            if n_check <= 0: continue
+            if not close_now > slope * cur + intercept + threshold: continue # 今天没突破这条线
+            violations = 0
+            for k in range(idx_a + 1, cur):
+                if highs[k] > slope * k + intercept:
+                    violations += 1
+                    if violations / n_check > 0.05: break
+            if violations / n_check > 0.05: continue
+            return idx_a, idx_b
+    return -1, -1
+
+def _trendline_numpy(highs, peaks, cur, close_now, threshold, min_dist):
+    """同 _trendline_kernel，没有 numba 时用 NumPy 整段比较做天花板测试"""
+    for i in range(len(peaks)):
+        idx_a = peaks[i]
+        if (cur - idx_a) < 30: continue
+        price_a = highs[idx_a]
+        for j in range(i + 1, len(peaks)):
+            idx_b = peaks[j]
+            price_b = highs[idx_b]
+            if (idx_b - idx_a) < min_dist: continue
+            if price_b >= price_a: continue # 下降趋势
+            slope = (price_b - price_a) / (idx_b - idx_a)
+            intercept = price_a - slope * idx_a
+            check_range = np.arange(idx_a + 1, cur)
+            if len(check_range) == 0: continue
+            if not close_now > slope * cur + intercept + threshold: continue # 先做 O(1) 突破判定
+            violations = np.sum(highs[check_range] > slope * check_range + intercept)
+            if violations / len(check_range) > 0.05: continue
+            return idx_a, idx_b
+    return -1, -1
+
+def find_trendline_breakout(highs, peaks, cur, close_now, threshold, min_dist):
+    """寻找被今日收盘突破的最长下降趋势线，返回锚点 (idx_a, idx_b)，没有返回 (-1, -1)"""
+    if HAS_NUMBA:
+        return _trendline_kernel(highs, peaks, cur, close_now, threshold, min_dist)
+    return _trendline_numpy(highs, peaks, cur, close_now, threshold, min_dist)
+
+@njit(cache=True)
+def _macd_kdj_kernel(low, macd, macd_signal, k, d, window):
+    """
+    MACD 底背离 + KDJ 低位金叉的判定 (numba 编译；只有几十次标量运算，没有 numba 时直接跑 Python 也不慢)
+    返回 (是否通过, MACD 最低点下标)，最低点在最近 window 天里找，缺值跳过
+    """
+    n = len(k)
+
+    # === 第一步：检查 KDJ 金叉 (战术信号) ===
+    # 今天 K在D上，且昨天K在D下；金叉最好发生在低位 (K < 50)，高位金叉可能是诱多
+    if not (k[n - 1] > d[n - 1] and k[n - 2] < d[n - 2] and k[n - 1] < 50):
+        return False, -1
+
+    # === 第二步：检查 MACD 底背离 (战略信号) ===
+    # 定义背离：股价创新低，但 MACD 没有创新低；一趟循环同时找窗口内股价、MACD (DIF线) 的最低点 (并列取最早)
+    min_price_idx = -1
+    min_macd_idx = -1
+    for i in range(n - window, n):
+        if not np.isnan(low[i]) and (min_price_idx < 0 or low[i] < low[min_price_idx]):
+            min_price_idx = i
+        if not np.isnan(macd[i]) and (min_macd_idx < 0 or macd[i] < macd[min_macd_idx]):
+            min_macd_idx = i
+    if min_price_idx < 0 or min_macd_idx < 0:
+        return False, -1
+
+    # A. 股价最低点必须发生在最近 (比如最近 3-5 天内)，说明刚刚经历下跌
+    # B. MACD 的最低点必须发生在比较久之前，最近股价跌了，但 MACD 没跟着跌到新低
+    # C. 当前 MACD 值高于之前的最低 MACD 值
+    # D. MACD 也是金叉状态 (DIF > DEA)
+    passed = ((n - 1 - min_price_idx) <= 5
+              and (min_price_idx - min_macd_idx) > 3
+              and macd[n - 1] > macd[min_macd_idx]
+              and macd[n - 1] > macd_signal[n - 1])
+    return passed, min_macd_idx
+
+def _parallel_scan(tables, scan_one, max_workers=8):
+    """
+    多线程逐表扫描：scan_one(table, conn) 在线程池里跑，每个工作线程持有一条自己的只读连接
+    结果按 tables 原顺序返回，scan_one 返回 None 的表直接丢弃
+    """
+    local = threading.local()
+    conns = []
+
+    def worker(table):
+        conn = getattr(local, 'conn', None)
+        if conn is None:
+            conn = local.conn = db.open_ro(check_same_thread=False)
+            conns.append(conn)
+        return scan_one(table, conn)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return [res for res in executor.map(worker, tables) if res is not None]
+    finally:
+        for conn in conns:
+            conn.close()
 
 class StrategyRunner:
-    def __init__(self):
-        """初始化：连接数据库"""
-        self.conn = sqlite3.connect(config.DB_NAME)
+    def __init__(self, cache=None):
+        """初始化：连接数据库 (进程内共享的只读连接)"""
+        self.conn = db.get_conn()
+        self.cache = cache # 可选 PriceCache，MACD+KDJ 扫描优先从内存读
+        self._latest = None # (表列名, 最新一行 DataFrame)，首次用到时加载
 
     def _get_all_tables(self):
-        """内部工具：获取数据库中所有股票表名"""
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name LIKE 'stock_%'")
-        return [row[0] for row in cursor.fetchall()]
+        """内部工具：获取数据库中所有股票表名 (表结构没变时直接用缓存)"""
+        return db.get_tables(self.conn)
 
-    def _get_latest_row(self, table_name):
-        """内部工具：快速获取某只股票最新的一行数据"""
-        try:
-            # 取最新的一行，包含所有计算好的指标 (EMA, Return等)
-            query = f"SELECT * FROM {table_name} ORDER BY Date DESC LIMIT 1"
-            df = pd.read_sql(query, self.conn)
-            if not df.empty:
-                return df.iloc[0]
-        except:
-            pass
-        return None
+    def _load_latest(self):
+        """
+        内部工具：所有日线表的最新一行 (全部列) 只查一次，缓存在实例上
+        涨幅榜、均线回调、多头排列等策略共用这一份数据，返回 (表列名, DataFrame)
+        """
+        if self._latest is None:
+            table_cols = {t: cols for t, cols in db.get_table_columns(self.conn).items() if 'Date' in cols}
+            columns = sorted(set().union(*table_cols.values()))
+            self._latest = (table_cols, _get_latest_frame(self.conn, columns, table_cols))
+        return self._latest
+
+    def _get_latest_frame(self, columns):
+        """内部工具：共享最新一行数据里取出需要的列 (没有任何表有的列为空值)"""
+        return self._load_latest()[1].reindex(columns=['__tbl'] + list(columns))
+
+    def _get_latest_rows(self, columns):
+        """
+        内部工具：所有日线表的最新一行，返回 [(表名, 行字典)]
+        行字典只包含该表真实存在的列，缺列时 .get() 行为与逐表查询一致
+        空值还原成 None (逐表查单行时 NULL 读出来就是 None，不是 NaN)
+        """
+        table_cols = self._load_latest()[0]
+        results = []
+        for rec in self._get_latest_frame(columns).to_dict('records'):
+            table = rec.pop('__tbl')
+            results.append((table, {c: (v if pd.notna(v) else None) for c, v in rec.items() if c in table_cols[table]}))
+        return results
 
     # ==========================================
     # 策略 1: 寻找近期涨幅榜 (Momentum)
@@ -37,81 +361,61 @@ class StrategyRunner:
         :param days: 周期 (5, 20, 60...)
         :param top_n: 返回前几名
         """
-        results = []
-        tables = self._get_all_tables()
         col_name = f"Return_{days}d"
 
         print(f"🔎 [策略执行] 扫描 {days} 日涨幅榜...")
 
-        for table in tables:
-            # 兼容性处理：如果数据库没存 Ticker 列，则从表名提取
-            ticker_name = table.replace('stock_', '').replace('_', '-')
-            
-            row = self._get_latest_row(table)
-            
-            # 确保数据存在且涨幅不为空
-            if row is not None and pd.notna(row.get(col_name)):
-                # 如果数据库里有 Ticker 列，优先用数据库里的
-                if 'Ticker' in row and pd.notna(row['Ticker']):
-                    ticker_name = row['Ticker']
-
-                current_close = row['Close']
-                return_rate = row[col_name] # 例如 0.20 代表 20%
-                
-                # 🔥 核心修改：通过涨幅反推 X 天前的价格
-                # 公式：旧价格 = 现价 / (1 + 涨幅)
-                prev_close = current_close / (1 + return_rate)
+        # 所有表的最新一行一次查完，之后整列计算
+        latest = self._get_latest_frame(['Ticker', 'Close', col_name])
 
-                results.append({
-                    'Ticker': ticker_name,
-                    'Close': current_close,       # 当前价格
-                    'Prev_Close': prev_close,     # X天前价格 (新增)
-                    'Score': return_rate,         # 涨幅
-                    'Strategy': f'Top Gainers ({days}d)'
-                })
+        # 确保涨幅不为空
+        latest = latest[latest[col_name].notna()]
+        if latest.empty: return []
 
-        # 排序并取前 N 名
-        df = pd.DataFrame(results)
-        if df.empty: return []
-        
-        # 按涨幅降序排列
-        df = df.sort_values(by='Score', ascending=False).head(top_n)
-        return df.to_dict('records')
+        # 兼容性处理：如果数据库里有 Ticker 列，优先用数据库里的，否则从表名提取
+        table_ticker = latest['__tbl'].str.replace('stock_', '').str.replace('_', '-')
+        return_rate = latest[col_name].astype(float) # 例如 0.20 代表 20%
+
+        df = pd.DataFrame({
+            'Ticker': latest['Ticker'].where(latest['Ticker'].notna(), table_ticker),
+            'Close': latest['Close'],                        # 当前价格
+            # 🔥 核心修改：通过涨幅反推 X 天前的价格
+            # 公式：旧价格 = 现价 / (1 + 涨幅)
+            'Prev_Close': latest['Close'] / (1 + return_rate), # X天前价格 (新增)
+            'Score': return_rate,                            # 涨幅
+            'Strategy': f'Top Gainers ({days}d)'
+        })
+
+        # 按涨幅取前 N 名 (部分排序)
+        return df.nlargest(top_n, 'Score').to_dict('records')
 
     # ==========================================
     # 策略 2: 均线回调买入 (已更新：显示现价)
     # ==========================================
     def run_ema_pullback(self, tolerance=0.015):
         results = []
-        tables = self._get_all_tables()
         
         print(f"🔎 [策略执行] 扫描均线回调机会...")
 
-        for table in tables:
-            # 提取 Ticker (兼容旧数据)
-            ticker_name = table.replace('stock_', '').replace('_', '-')
-            
-            row = self._get_latest_row(table)
-            if row is None: continue
-
-            # 优先使用数据库里的 Ticker 列，如果没有则用表名提取的
-            if 'Ticker' in row and pd.notna(row['Ticker']):
-                ticker_name = row['Ticker']
+        table_cols = self._load_latest()[0]
+        latest = self._get_latest_frame(['Ticker', 'Close', 'EMA20', 'EMA60', 'EMA120', 'EMA200', 'Return_20d'])
+        # 数值列一次转成 NumPy 矩阵，循环里按位置解包，不再逐个 row.get (缺列/空值为 NaN)
+        values = latest[['Close', 'EMA20', 'EMA60', 'EMA120', 'EMA200', 'Return_20d']].to_numpy(float)
 
-            close = row['Close']
-            ema200 = row.get('EMA200')
+        for table, ticker, (close, ema20, ema60, ema120, ema200, ret_20d) in zip(latest['__tbl'], latest['Ticker'], values):
+            # 优先使用数据库里的 Ticker 列，如果没有则从表名提取 (兼容旧数据)
+            ticker_name = ticker if pd.notna(ticker) else table.replace('stock_', '').replace('_', '-')
 
             # 1. 趋势过滤：只看多头排列 (股价 > 年线)
-            if ema200 is None or close < ema200:
+            if np.isnan(ema200) or close < ema200:
                 continue
 
             # 2. 检查回调
             matched_ema = None
             matched_val = 0 # 用于记录具体均线数值
             
-            for span in [20, 60, 120]:
-                ema_val = row.get(f'EMA{span}')
-                if ema_val:
+            for span, ema_val in ((20, ema20), (60, ema60), (120, ema120)):
+                if ema_val and not np.isnan(ema_val):
                     upper = ema_val * (1 + tolerance)
                     lower = ema_val * (1 - tolerance)
                     if lower <= close <= upper:
@@ -123,10 +427,16 @@ class StrategyRunner:
                 # 计算乖离率 (当前价格相对于均线的百分比差异)
                 diff_pct = (close - matched_val) / matched_val
                 
+                # 表里没有 Return_20d 列记 0，有列但为空记 None
+                if 'Return_20d' not in table_cols[table]:
+                    score = 0
+                else:
+                    score = None if np.isnan(ret_20d) else ret_20d
+
                 results.append({
                     'Ticker': ticker_name,
                     'Close': close,
-                    'Score': row.get('Return_20d', 0),
+                    'Score': score,
                     'Strategy': 'EMA Pullback',
                     # 🔥 修改点：在这里加上了“现价”信息
                     'Detail': f"现价 ${close:.2f} (偏离 {diff_pct:+.2%}) -> 支撑于 {matched_ema} (${matched_val:.2f})"
@@ -141,304 +451,234 @@ class StrategyRunner:
         """
         筛选策略：EMA20 > EMA60 > EMA120 > EMA200 (超强趋势)
         """
-        results = []
-        tables = self._get_all_tables()
         print(f"🔎 [策略执行] 扫描超强多头排列...")
 
-        for table in tables:
-            row = self._get_latest_row(table)
-            if row is None: continue
-
-            try:
-                # 必须所有均线都有值
-                if (row['EMA20'] > row['EMA60'] > row['EMA120'] > row['EMA200']):
-                    # 且当前价格在所有均线之上
-                    if row['Close'] > row['EMA20']:
-                        results.append({
-                            'Ticker': row['Ticker'],
-                            'Close': row['Close'],
-                            'Score': row['Return_60d'],
-                            'Strategy': 'Strong Trend',
-                            'Detail': '均线完美多头排列'
-                        })
-            except:
-                continue
-                
-        return results
+        # 共享的最新一行数据上整列过滤，缺任何一列的表跳过
+        table_cols, latest = self._load_latest()
+        required = {'Ticker', 'Close', 'EMA20', 'EMA60', 'EMA120', 'EMA200', 'Return_60d'}
+        latest = latest[latest['__tbl'].map(lambda t: required <= table_cols[t]).astype(bool)]
+        if latest.empty: return []
+
+        close, ema20, ema60, ema120, ema200 = (latest[c].to_numpy(float) for c in ['Close', 'EMA20', 'EMA60', 'EMA120', 'EMA200'])
+        # 必须所有均线都有值 (缺值比较为 False)，且当前价格在所有均线之上
+        strong = (ema20 > ema60) & (ema60 > ema120) & (ema120 > ema200) & (close > ema20)
+        hits = latest[strong]
+
+        return [{
+            'Ticker': ticker if pd.notna(ticker) else None,
+            'Close': close_price,
+            'Score': ret_60d if pd.notna(ret_60d) else None,
+            'Strategy': 'Strong Trend',
+            'Detail': '均线完美多头排列'
+        } for ticker, close_price, ret_60d in zip(hits['Ticker'], hits['Close'], hits['Return_60d'])]
     
     # ==========================================
     # 策略 4: MACD 底背离 + KDJ 金叉 (高胜率共振)
     # ==========================================
-    def run_macd_divergence_kdj(self):
-        results = []
-        tables = self._get_all_tables()
-        print("🔎 [策略执行] 扫描 MACD底背离 + KDJ金叉 共振机会...")
+    def _scan_macd_kdj(self, table, conn, columns):
+        """扫描单只股票的 MACD 底背离 + KDJ 金叉，没有信号返回 None (columns: 该表的列名集合)"""
+        # 1. 获取最近 60 天数据 (需要历史数据来判断背离)
+        # 只取用到的几列，游标直接拿元组，不组 DataFrame
+        has_ticker = 'Ticker' in columns
+        select_cols = (['Ticker'] if has_ticker else []) + ['Close', 'Low', 'MACD', 'MACD_Signal', 'K', 'D']
+        try:
+            n, data = _read_recent_arrays(conn, table, 60, select_cols, self.cache)
+            
+            if n < 30: return None # 新股数据太少，跳过
+        except:
+            return None
 
-        for table in tables:
-            # 1. 获取最近 60 天数据 (需要历史数据来判断背离)
-            try:
-                query = f"SELECT * FROM {table} ORDER BY Date DESC LIMIT 60"
-                df = pd.read_sql(query, self.conn)
-                
-                if len(df) < 30: continue # 新股数据太少，跳过
-                
-                # 数据库读出来是倒序的(最新在最前)，反转为正序(时间从左到右)方便计算
-                df = df.iloc[::-1].reset_index(drop=True)
-            except:
-                continue
+        close, low, macd, macd_signal, k, d = (data[c] for c in ['Close', 'Low', 'MACD', 'MACD_Signal', 'K', 'D'])
 
-            # 提取 Ticker
-            ticker_name = df['Ticker'].iloc[-1] if 'Ticker' in df.columns else table.replace('stock_', '').replace('_', '-')
+        # 提取 Ticker
+        ticker_name = data['Ticker'][-1] if has_ticker else table.replace('stock_', '').replace('_', '-')
 
-            # === 第一步：检查 KDJ 金叉 (战术信号) ===
-            # 逻辑：今天 K > D，且昨天 K < D (或非常接近)
-            # 注意：K和D是最后两行
-            curr_k, curr_d = df['K'].iloc[-1], df['D'].iloc[-1]
-            prev_k, prev_d = df['K'].iloc[-2], df['D'].iloc[-2]
+        # 金叉 + 背离的判定都在 _macd_kdj_kernel 里 (最近 20 天窗口)
+        passed, min_macd_idx = _macd_kdj_kernel(low, macd, macd_signal, k, d, 20)
+        if not passed:
+            return None
 
-            # 判定金叉：今天 K在D上，且 (昨天K在D下 或 昨天K,D还没拉开差距)
-            is_gold_cross = (curr_k > curr_d) and (prev_k < prev_d)
-            
-            # 增加一个过滤器：金叉最好发生在低位 (例如 K < 50)，高位金叉可能是诱多
-            if not (is_gold_cross and curr_k < 50):
-                continue 
+        return {
+            'Ticker': ticker_name,
+            'Close': close[-1],
+            'Score': k[-1], # 用K值作为排序参考
+            'Strategy': 'MACD Div + KDJ Cross',
+            'Detail': f"MACD底背离 (MACD底在{(n-1-min_macd_idx)}天前) + KDJ低位金叉"
+        }
 
-            # === 第二步：检查 MACD 底背离 (战略信号) ===
-            # 定义背离：股价创新低，但 MACD 没有创新低
-            
-            # 选取最近 20 天的窗口
-            window = 20
-            recent_df = df.iloc[-window:]
-            
-            # 1. 找到这20天内的股价最低点
-            min_price = recent_df['Low'].min()
-            min_price_idx = recent_df['Low'].idxmin()
-            
-            # 2. 找到这20天内的 MACD (DIF线) 最低点
-            min_macd = recent_df['MACD'].min()
-            min_macd_idx = recent_df['MACD'].idxmin()
-            
-            # 3. 判定逻辑
-            # A. 股价最低点必须发生在最近 (比如最近 3-5 天内)，说明刚刚经历下跌
-            price_is_new_low = (len(df) - 1 - min_price_idx) <= 5
-            
-            # B. MACD 的最低点必须发生在比较久之前 (比如 5 天以前)
-            # 这意味着最近股价跌了，但 MACD 没跟着跌到新低
-            macd_bottom_was_earlier = (min_price_idx - min_macd_idx) > 3
-            
-            # C. 再次确认：当前 MACD 值明显高于之前的最低 MACD 值
-            # 这里的 MACD 列对应 DIF 快线
-            current_macd_higher = df['MACD'].iloc[-1] > min_macd
-            
-            # D. 甚至可以要求 MACD 也是金叉状态 (DIF > DEA)
-            macd_gold = df['MACD'].iloc[-1] > df['MACD_Signal'].iloc[-1]
-
-            if price_is_new_low and macd_bottom_was_earlier and current_macd_higher and macd_gold:
-                results.append({
-                    'Ticker': ticker_name,
-                    'Close': df['Close'].iloc[-1],
-                    'Score': curr_k, # 用K值作为排序参考
-                    'Strategy': 'MACD Div + KDJ Cross',
-                    'Detail': f"MACD底背离 (MACD底在{(len(df)-1-min_macd_idx)}天前) + KDJ低位金叉"
-                })
+    def run_macd_divergence_kdj(self):
+        tables = self._get_all_tables()
+        table_cols = db.get_table_columns(self.conn)
+        print("🔎 [策略执行] 扫描 MACD底背离 + KDJ金叉 共振机会...")
 
-        return results
+        return _parallel_scan(tables, lambda table, conn: self._scan_macd_kdj(table, conn, table_cols.get(table, set())))
 
     def close(self):
-        self.conn.close()
+        # 共享连接由进程统一持有，这里只释放引用
+        self.conn = None
 
 class MarketPhaseScanner:
     def __init__(self):
-        self.conn = sqlite3.connect(config.DB_NAME)
+        self.conn = db.get_conn()
 
     def _get_all_tables(self):
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name LIKE 'stock_%'")
-        return [row[0] for row in cursor.fetchall()]
+        return db.get_tables(self.conn)
 
     def analyze_phase(self):
-        results = []
-        tables = self._get_all_tables()
         print("🔎 [策略执行] 正在全市场扫描，判断个股所处阶段 (左侧/右侧/震荡)...")
 
-        for table in tables:
-            try:
-                # 获取最近 60 天数据 (判断趋势需要一段时间)
-                df = pd.read_sql(f"SELECT * FROM {table} ORDER BY Date DESC LIMIT 60", self.conn)
-                if len(df) < 50: continue 
-                
-                # 转为正序
-                df = df.iloc[::-1].reset_index(drop=True)
-                
-                # 提取数据
-                row = df.iloc[-1]
-                ticker = row['Ticker'] if 'Ticker' in row else table.replace('stock_', '').replace('_', '-')
-                
-                # 必须包含均线数据
-                if pd.isna(row.get('EMA20')) or pd.isna(row.get('EMA120')):
-                    continue
-
-                close = row['Close']
-                ema20 = row['EMA20']
-                ema60 = row['EMA60']
-                ema120 = row['EMA120']
-                
-                # ==========================================
-                # 🔥 核心打分逻辑 (Score System)
-                # ==========================================
-                score = 0
-                
-                # 1. 价格位置 (Price Location)
-                if close > ema20: score += 1
-                elif close < ema20: score -= 1
-                
-                if close > ema60: score += 1
-                elif close < ema60: score -= 1
-
-                if close > ema120: score += 1 # 站稳半年线是很重要的右侧信号
-                elif close < ema120: score -= 1
-
-                # 2. 均线排列 (MA Alignment)
-                if ema20 > ema60: score += 1
-                elif ema20 < ema60: score -= 1
-                
-                if ema60 > ema120: score += 1
-                elif ema60 < ema120: score -= 1
-                
-                # 3. 趋势斜率 (MA Slope) - 判断是走平还是发散
-                # 计算 EMA60 今天的涨跌幅
-                prev_ema60 = df.iloc[-2]['EMA60']
-                slope = (ema60 - prev_ema60) / prev_ema60
-                
-                is_flat = abs(slope) < 0.0005 # 如果斜率非常小，说明均线走平 -> 震荡
-
-                # ==========================================
-                # ⚖️ 阶段判定
-                # ==========================================
-                phase = "未知"
-                advice = "观望"
-                color = "⚪"
-                
-                # 定义布林带带宽 (Bandwidth) - 辅助判断震荡
-                # Bandwidth = (上轨 - 下轨) / 中轨
-                # 如果你的数据库里没算布林带，这里可以用 (High20 - Low20) / Close 估算
-                
-                if is_flat or (abs(score) <= 1):
-                    phase = "🟡 震荡整理 (Consolidation)"
-                    advice = "高抛低吸 / 等待突破"
-                    color = "🟡"
-                elif score >= 4:
-                    phase = "🟢 强势右侧 (Strong Uptrend)"
-                    advice = "持有 / 回调EMA20买入"
-                    color = "🟢"
-                elif score >= 2:
-                    phase = "📈 弱势右侧 (Weak Uptrend)"
-                    advice = "谨慎做多"
-                    color = "📈"
-                elif score <= -4:
-                    phase = "🔴 极度左侧 (Strong Downtrend)"
-                    advice = "空仓 / 反弹做空"
-                    color = "🔴"
-                elif score <= -2:
-                    phase = "📉 弱势左侧 (Weak Downtrend)"
-                    advice = "勿抄底"
-                    color = "📉"
-                
-                results.append({
-                    'Ticker': ticker,
-                    'Close': close,
-                    'Score': score,
-                    'Phase': phase,
-                    'Advice': advice,
-                    'Color': color
-                })
-
-            except Exception as e:
-                continue
+        # 所有表最近两天 (今天 + 昨天算斜率) 一次查完，整列打分
+        table_cols = {t: cols for t, cols in db.get_table_columns(self.conn).items() if {'Date', 'Close', 'EMA60'} <= cols}
+        df = _get_latest_frame(self.conn, ['Ticker', 'Close', 'EMA20', 'EMA60', 'EMA120'], table_cols, rows=2, count_limit=50)
+
+        # 至少 50 天数据 (判断趋势需要一段时间)，这样每张表都正好有今天、昨天两行
+        df = df[df['__n'] >= 50]
+        latest = df.iloc[0::2].reset_index(drop=True)
+        prev_ema60 = df['EMA60'].iloc[1::2].to_numpy(float)
+
+        # 必须包含均线数据
+        has_ema = (latest['EMA20'].notna() & latest['EMA120'].notna()).to_numpy()
+        latest, prev_ema60 = latest[has_ema], prev_ema60[has_ema]
+        if latest.empty: return []
+
+        close = latest['Close'].to_numpy(float)
+        ema20 = latest['EMA20'].to_numpy(float)
+        ema60 = latest['EMA60'].to_numpy(float)
+        ema120 = latest['EMA120'].to_numpy(float)
+
+        def vote(a, b):
+            """a > b 记 +1，a < b 记 -1，相等或缺值记 0"""
+            return (a > b).astype(np.int8) - (a < b).astype(np.int8)
+
+        # ==========================================
+        # 🔥 核心打分逻辑 (Score System)
+        # ==========================================
+        # 1. 价格位置 (Price Location)，站稳半年线是很重要的右侧信号
+        # 2. 均线排列 (MA Alignment)
+        score = vote(close, ema20) + vote(close, ema60) + vote(close, ema120) + vote(ema20, ema60) + vote(ema60, ema120)
+
+        # 3. 趋势斜率 (MA Slope) - 判断是走平还是发散
+        # 计算 EMA60 今天的涨跌幅
+        with np.errstate(divide='ignore', invalid='ignore'):
+            slope = (ema60 - prev_ema60) / prev_ema60
+        is_flat = np.abs(slope) < 0.0005 # 如果斜率非常小，说明均线走平 -> 震荡
+
+        # ==========================================
+        # ⚖️ 阶段判定 (按顺序取第一个满足的条件)
+        # ==========================================
+        conditions = [is_flat | (np.abs(score) <= 1), score >= 4, score >= 2, score <= -4, score <= -2]
+        phase = np.select(conditions, [
+            "🟡 震荡整理 (Consolidation)",
+            "🟢 强势右侧 (Strong Uptrend)",
+            "📈 弱势右侧 (Weak Uptrend)",
+            "🔴 极度左侧 (Strong Downtrend)",
+            "📉 弱势左侧 (Weak Downtrend)",
+        ], default="未知")
+        advice = np.select(conditions, ["高抛低吸 / 等待突破", "持有 / 回调EMA20买入", "谨慎做多", "空仓 / 反弹做空", "勿抄底"], default="观望")
+        color = np.select(conditions, ["🟡", "🟢", "📈", "🔴", "📉"], default="⚪")
+
+        # 表里没有 Ticker 列时从表名提取
+        has_ticker_col = latest['__tbl'].map(lambda t: 'Ticker' in table_cols[t]).to_numpy(bool)
+        table_ticker = latest['__tbl'].str.replace('stock_', '').str.replace('_', '-')
+        ticker = np.where(has_ticker_col, latest['Ticker'].to_numpy(object), table_ticker.to_numpy(object))
+
+        results = pd.DataFrame({
+            'Ticker': ticker,
+            'Close': close,
+            'Score': score,
+            'Phase': phase,
+            'Advice': advice,
+            'Color': color
+        }).to_dict('records')
 
         # 按分数排序：从最强右侧 到 最强左侧
         return sorted(results, key=lambda x: x['Score'], reverse=True)
 
     def close(self):
-        self.conn.close()
+        # 共享连接由进程统一持有，这里只释放引用
+        self.conn = None
 
 class ReversalScanner:
-    def __init__(self):
-        self.conn = sqlite3.connect(config.DB_NAME)
+    def __init__(self, cache=None):
+        self.conn = db.get_conn()
+        self.cache = cache # 可选 PriceCache
 
     def _get_all_tables(self):
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name LIKE 'stock_%'")
-        return [row[0] for row in cursor.fetchall()]
+        return db.get_tables(self.conn)
 
-    def run_short_term_reversal(self):
-        results = []
-        tables = self._get_all_tables()
-        print("🔎 [策略执行] 扫描‘超短线5/10日反转’形态...")
+    def _scan_one(self, table, conn, columns):
+        """扫描单只股票的 5/10 日反转形态，没有信号返回 None (columns: 该表的列名集合)"""
+        try:
+            # 检查是否有 EMA5 和 EMA10 列
+            if not {'EMA5', 'EMA10'} <= columns:
+                return None
+
+            # 只需要最近 10 天、用到的几列
+            has_ticker = 'Ticker' in columns
+            n, data = _read_recent_arrays(conn, table, 10, (['Ticker'] if has_ticker else []) + ['Close', 'Low', 'EMA5', 'EMA10'], self.cache)
+            if n < 5: return None
+            
+            ticker = data['Ticker'][-1] if has_ticker else table.replace('stock_', '').replace('_', '-')
+            close = data['Close'][-1]
+            ema5 = data['EMA5'][-1]   # 快线 (攻击线)
+            ema10 = data['EMA10'][-1] # 慢线 (操盘线)
 
-        for table in tables:
-            try:
-                # 只需要最近 30 天数据即可
-                df = pd.read_sql(f"SELECT * FROM {table} ORDER BY Date DESC LIMIT 10", self.conn)
-                if len(df) < 5: continue
-                
-                # 转正序
-                df = df.iloc[::-1].reset_index(drop=True)
-                row = df.iloc[-1]
-                ticker = row['Ticker'] if 'Ticker' in row else table.replace('stock_', '').replace('_', '-')
-                
-                # 检查是否有 EMA5 和 EMA10 列
-                if pd.isna(row.get('EMA5')) or pd.isna(row.get('EMA10')): 
-                    continue
+            if np.isnan(ema5) or np.isnan(ema10):
+                return None
 
-                close = row['Close']
-                ema5 = row['EMA5']   # 快线 (攻击线)
-                ema10 = row['EMA10'] # 慢线 (操盘线)
+            # === 核心逻辑 (5日/10日版本) ===
+            
+            # 1. 价格站上 10日线 (短线生命线)
+            if not (close > ema10): 
+                return None
 
-                # === 核心逻辑 (5日/10日版本) ===
-                
-                # 1. 价格站上 10日线 (短线生命线)
-                if not (close > ema10): 
-                    continue
+            # 2. 5日线金叉10日线 (刚刚启动)
+            # 判定：EMA5 > EMA10 且 两者距离非常近 (3%以内)
+            bias = (ema5 - ema10) / ema10
+            
+            is_just_crossed = (0 < bias < 0.03) 
+            
+            if not is_just_crossed:
+                return None
+
+            # 3. 拒绝高位接盘 (短线)
+            # 判定：当前价格 距离 过去20天最低价 涨幅不超过 15%
+            # 如果短线已经涨了20%以上再金叉，通常是鱼尾行情
+            lowest_price = np.nanmin(data['Low'])
+            gain_from_bottom = (close - lowest_price) / lowest_price
+            
+            # if gain_from_bottom > 0.15: 
+            #     continue 
 
-                # 2. 5日线金叉10日线 (刚刚启动)
-                # 判定：EMA5 > EMA10 且 两者距离非常近 (3%以内)
-                bias = (ema5 - ema10) / ema10
-                
-                is_just_crossed = (0 < bias < 0.03) 
-                
-                if not is_just_crossed:
-                    continue
-
-                # 3. 拒绝高位接盘 (短线)
-                # 判定：当前价格 距离 过去20天最低价 涨幅不超过 15%
-                # 如果短线已经涨了20%以上再金叉，通常是鱼尾行情
-                lowest_price = df['Low'].min()
-                gain_from_bottom = (close - lowest_price) / lowest_price
-                
-                # if gain_from_bottom > 0.15: 
-                #     continue 
+            # 4. (可选) 昨天的 EMA5 还在 EMA10 下方 (确认是今天刚金叉)
+            # prev_row = df.iloc[-2]
+            # if prev_row['EMA5'] > prev_row['EMA10']: continue
 
-                # 4. (可选) 昨天的 EMA5 还在 EMA10 下方 (确认是今天刚金叉)
-                # prev_row = df.iloc[-2]
-                # if prev_row['EMA5'] > prev_row['EMA10']: continue
+            return {
+                'Ticker': ticker,
+                'Close': close,
+                'Score': gain_from_bottom, 
+                'Strategy': '5/10 Day Reversal',
+                'Detail': f"站上EMA10 + 5日线金叉 (距20日底 +{gain_from_bottom:.1%})"
+            }
 
-                results.append({
-                    'Ticker': ticker,
-                    'Close': close,
-                    'Score': gain_from_bottom, 
-                    'Strategy': '5/10 Day Reversal',
-                    'Detail': f"站上EMA10 + 5日线金叉 (距20日底 +{gain_from_bottom:.1%})"
-                })
+        except Exception as e:
+            return None
 
-            except Exception as e:
-                continue
+    def run_short_term_reversal(self):
+        tables = self._get_all_tables()
+        table_cols = db.get_table_columns(self.conn)
+        print("🔎 [策略执行] 扫描‘超短线5/10日反转’形态...")
 
-        return results
+        return _parallel_scan(tables, lambda table, conn: self._scan_one(table, conn, table_cols.get(table, set())))
+
+    def close(self):
+        # 共享连接由进程统一持有，这里只释放引用
+        self.conn = None
 
 class TrendlineScanner:
     def __init__(self):
-        self.conn = sqlite3.connect(config.DB_NAME)
+        self.conn = db.get_conn()
         
         # ================= 配置参数 =================
         self.use_log_scale = True     # 🔥 开启对数坐标 (关键修改)
@@ -450,208 +690,230 @@ class TrendlineScanner:
         # ===========================================
 
     def _get_all_tables(self):
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name LIKE 'stock_%'")
-        return [row[0] for row in cursor.fetchall()]
+        return db.get_tables(self.conn)
+
+    def _scan_one(self, table, conn):
+        """扫描单只股票的趋势线突破，没有信号返回 None"""
+        try:
+            # 1. 获取数据
+            df = _read_recent(conn, table, self.lookback_days)
+            if len(df) < 100: return None 
+            df['Date'] = pd.to_datetime(df['Date'], format='ISO8601')
+            
+            ticker = df['Ticker'].iloc[-1] if 'Ticker' in df.columns else table.replace('stock_', '').replace('_', '-')
+            
+            # 🔥 关键步骤：转换到对数空间
+            if self.use_log_scale:
+                # 使用 np.log 处理价格
+                # 所有的画线逻辑都在 log_highs 上进行
+                raw_highs = df['High'].values
+                highs = np.log(raw_highs) 
+                
+                raw_closes = df['Close'].values
+                closes = np.log(raw_closes)
+            else:
+                highs = df['High'].values
+                closes = df['Close'].values
+
+            current_idx = len(df) - 1
+            
+            # 2. 寻找波峰 (在对数空间找波峰，其实位置和普通空间一样，但数值不同)
+            peak_indexes = find_peaks(highs, self.peak_order)
+            if len(peak_indexes) < 2: return None
+
+            # 3. 遍历寻找锚点 + 天花板测试 + 判断突破 (热循环在 find_trendline_breakout 里)
+            # 判定条件：log(Close) > log(Resistance) + 阈值
+            # 注意：对数空间的加减，对应原始空间的乘除
+            # log(A) > log(B) + log(1.005)  =>  A > B * 1.005
+            threshold_log = np.log(self.breakout_threshold)
+            log_close_now = closes[-1]
+            idx_a, idx_b = find_trendline_breakout(
+                highs, peak_indexes, current_idx, log_close_now, threshold_log, self.min_dist_between_pts
+            )
+            if idx_a < 0: return None
+
+            # === 还原趋势线方程 (对数空间) ===
+            # log(y) = kx + b，注意：这里的 price_a 是对数值 (如 4.56)
+            price_a = highs[idx_a]
+            price_b = highs[idx_b]
+            slope = (price_b - price_a) / (idx_b - idx_a)
+            intercept = price_a - slope * idx_a
+            log_resistance_now = slope * current_idx + intercept
+
+            duration = current_idx - idx_a
+            date_a = df['Date'].iloc[idx_a].strftime('%Y-%m-%d')
+            date_b = df['Date'].iloc[idx_b].strftime('%Y-%m-%d')
+            
+            # 🔥 还原显示价格 (从 Log 变回 $)
+            # 为了显示给人类看，必须用 np.exp 还原
+            real_price_a = np.exp(price_a) if self.use_log_scale else price_a
+            real_price_b = np.exp(price_b) if self.use_log_scale else price_b
+            real_resistance = np.exp(log_resistance_now) if self.use_log_scale else log_resistance_now
+            real_close = np.exp(log_close_now) if self.use_log_scale else log_close_now
+            
+            return {
+                'Ticker': ticker,
+                'Close': real_close,
+                'Resistance': real_resistance, # 这是对数趋势线对应的今日阻力位
+                'Duration': duration,
+                'PointA': f"{date_a} (${real_price_a:.2f})",
+                'PointB': f"{date_b} (${real_price_b:.2f})",
+                'Detail': f"突破 {duration}天 对数趋势线"
+            }
+
+        except Exception:
+            return None
 
     def run_trendline_breakout(self):
-        results = []
         tables = self._get_all_tables()
         mode_str = "对数Log" if self.use_log_scale else "普通Linear"
         print(f"🔎 [策略执行] 扫描‘长期下降趋势线突破’ ({mode_str}模式)...")
 
-        for table in tables:
-            try:
-                # 1. 获取数据
-                df = pd.read_sql(f"SELECT * FROM {table} ORDER BY Date DESC LIMIT {self.lookback_days}", self.conn, parse_dates=['Date'])
-                if len(df) < 100: continue 
-                
-                df = df.iloc[::-1].reset_index(drop=True)
-                ticker = df['Ticker'].iloc[-1] if 'Ticker' in df.columns else table.replace('stock_', '').replace('_', '-')
-                
-                # 🔥 关键步骤：转换到对数空间
-                if self.use_log_scale:
-                    # 使用 np.log 处理价格
-                    # 所有的画线逻辑都在 log_highs 上进行
-                    raw_highs = df['High'].values
-                    highs = np.log(raw_highs) 
-                    
-                    raw_closes = df['Close'].values
-                    closes = np.log(raw_closes)
-                else:
-                    highs = df['High'].values
-                    closes = df['Close'].values
-
-                current_idx = len(df) - 1
-                
-                # 2. 寻找波峰 (在对数空间找波峰，其实位置和普通空间一样，但数值不同)
-                peak_indexes = argrelextrema(highs, np.greater, order=self.peak_order)[0]
-                if len(peak_indexes) < 2: continue
-
-                best_breakout = None
-
-                # 3. 遍历寻找锚点
-                for i in range(len(peak_indexes)):
-                    idx_a = peak_indexes[i]
-                    price_a = highs[idx_a] # 注意：这里的 price_a 是对数值 (如 4.56)
-                    
-                    if (current_idx - idx_a) < 30: continue
-                    
-                    for j in range(i + 1, len(peak_indexes)):
-                        idx_b = peak_indexes[j]
-                        price_b = highs[idx_b]
-                        
-                        if (idx_b - idx_a) < self.min_dist_between_pts: continue
-                        if price_b >= price_a: continue # 下降趋势
-                        
-                        # === 建立方程 (对数空间) ===
-                        # log(y) = kx + b
-                        slope = (price_b - price_a) / (idx_b - idx_a)
-                        intercept = price_a - slope * idx_a
-                        
-                        # === 天花板测试 ===
-                        check_range = np.arange(idx_a + 1, current_idx) 
-                        if len(check_range) == 0: continue
-
-                        line_values = slope * check_range + intercept
-                        actual_highs = highs[check_range]
-                        
-                        violations = np.sum(actual_highs > line_values)
-                        violation_rate = violations / len(check_range)
-                        
-                        if violation_rate > 0.05: continue
-
-                        # === 判断突破 ===
-                        log_resistance_now = slope * current_idx + intercept
-                        log_close_now = closes[-1]
-                        
-                        # 判定条件：log(Close) > log(Resistance) + 阈值
-                        # 注意：对数空间的加减，对应原始空间的乘除
-                        # log(A) > log(B) + log(1.005)  =>  A > B * 1.005
-                        threshold_log = np.log(self.breakout_threshold)
-                        
-                        if log_close_now > log_resistance_now + threshold_log:
-                            
-                            duration = current_idx - idx_a
-                            date_a = df['Date'].iloc[idx_a].strftime('%Y-%m-%d')
-                            date_b = df['Date'].iloc[idx_b].strftime('%Y-%m-%d')
-                            
-                            # 🔥 还原显示价格 (从 Log 变回 $)
-                            # 为了显示给人类看，必须用 np.exp 还原
-                            real_price_a = np.exp(price_a) if self.use_log_scale else price_a
-                            real_price_b = np.exp(price_b) if self.use_log_scale else price_b
-                            real_resistance = np.exp(log_resistance_now) if self.use_log_scale else log_resistance_now
-                            real_close = np.exp(log_close_now) if self.use_log_scale else log_close_now
-                            
-                            if best_breakout is None or duration > best_breakout['Duration']:
-                                best_breakout = {
-                                    'Ticker': ticker,
-                                    'Close': real_close,
-                                    'Resistance': real_resistance, # 这是对数趋势线对应的今日阻力位
-                                    'Duration': duration,
-                                    'PointA': f"{date_a} (${real_price_a:.2f})",
-                                    'PointB': f"{date_b} (${real_price_b:.2f})",
-                                    'Detail': f"突破 {duration}天 对数趋势线"
-                                }
-                
-                if best_breakout:
-                    results.append(best_breakout)
-
-            except Exception:
-                continue
-
-        return results
+        return _parallel_scan(tables, self._scan_one)
     
 
 class HighWinRateScanner:
-    def __init__(self):
-        self.conn = sqlite3.connect(config.DB_NAME)
+    def __init__(self, cache=None):
+        self.conn = db.get_conn()
+        self.cache = cache # 可选 PriceCache
 
     def _get_all_tables(self):
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name LIKE 'stock_%'")
-        return [row[0] for row in cursor.fetchall()]
+        return db.get_tables(self.conn)
 
     def get_realtime_market_cap(self, ticker):
         """联网获取最新市值 (单位: 亿)"""
+        return self.get_realtime_market_caps([ticker]).get(ticker, 0)
+
+    def get_realtime_market_caps(self, tickers):
+        """
+        批量获取最新市值 (单位: 亿)，返回 {ticker: 市值}
+        先查本地市值缓存 (.cache/market_cap_cache.db，24 小时有效)，缺的用一次 yf.Tickers 批量补齐再写回缓存
+        缺失的股票在线程池里并发查询，总耗时约等于最慢的一次请求，而不是逐只累加
+        """
+        caps = {}
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        conn = sqlite3.connect(MARKET_CAP_CACHE_DB)
         try:
-            info = yf.Ticker(ticker).info
-            mkt_cap = info.get('marketCap', 0)
-            return mkt_cap / 100000000 # 换算成“亿”
-        except:
-            return 0
+            with conn:
+                conn.execute("CREATE TABLE IF NOT EXISTS market_cap_cache (Ticker TEXT PRIMARY KEY, MarketCap REAL, Updated REAL)")
+                placeholders = ",".join("?" * len(tickers))
+                rows = conn.execute(
+                    f"SELECT Ticker, MarketCap FROM market_cap_cache WHERE Updated > ? AND Ticker IN ({placeholders})",
+                    [time.time() - MARKET_CAP_CACHE_TTL, *tickers]
+                ).fetchall()
+            caps.update(rows)
+
+            missing = [t for t in dict.fromkeys(tickers) if t not in caps]
+            if not missing:
+                return caps
+
+            fetched = []
+            try:
+                batch = yf.Tickers(" ".join(missing)).tickers
+            except Exception:
+                batch = {}
+
+            def fetch_cap(ticker):
+                try:
+                    return batch[ticker.upper()].fast_info['market_cap'] or 0
+                except Exception:
+                    return 0
+
+            with ThreadPoolExecutor(max_workers=min(MARKET_CAP_FETCH_WORKERS, len(missing))) as executor:
+                mkt_caps = list(executor.map(fetch_cap, missing))
+
+            for ticker, mkt_cap in zip(missing, mkt_caps):
+                caps[ticker] = mkt_cap / 100000000 # 换算成“亿”
+                if mkt_cap > 0: # 查询失败不进缓存，下次重试
+                    fetched.append((ticker, caps[ticker], time.time()))
+
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO market_cap_cache VALUES (?, ?, ?)", fetched)
+        finally:
+            conn.close()
+        return caps
 
     def run(self):
         results = []
+        candidates = [] # 通过技术指标关卡的候选股 (ticker, 现价, RSI, ATR%)
+        table_cols = db.get_table_columns(self.conn)
         tables = self._get_all_tables()
         print("🔎 [策略执行] 扫描‘高胜率超跌’ (RSI<30 + ATR>4% + 市值>200亿)...")
 
         for table in tables:
             try:
-                # 1. 获取数据 (至少需要20天计算ATR14)
-                df = pd.read_sql(f"SELECT * FROM {table} ORDER BY Date DESC LIMIT 30", self.conn)
-                if len(df) < 20: continue
-                
-                # 转正序
-                df = df.iloc[::-1].reset_index(drop=True)
-                ticker = df['Ticker'].iloc[-1] if 'Ticker' in df.columns else table.replace('stock_', '').replace('_', '-')
+                # 如果数据库里没有 RSI 列，直接跳过
+                columns = table_cols.get(table, set())
+                if 'RSI' not in columns: continue
+                select_cols = [c for c in ['Ticker', 'Close', 'RSI', 'ATR', 'High', 'Low'] if c in columns]
+
+                # 1. 获取数据 (至少需要20天计算ATR14)，只取用到的列
+                n, data = _read_recent_arrays(self.conn, table, 30, select_cols, self.cache)
+                if n < 20: continue
                 
-                row = df.iloc[-1]
+                ticker = data['Ticker'][-1] if 'Ticker' in data else table.replace('stock_', '').replace('_', '-')
+                close = data['Close']
                 
                 # ==========================================
                 # 🛑 第一道关卡：技术指标 (本地计算，极快)
                 # ==========================================
                 
-                # 1. 检查 RSI (超跌)
-                # 如果数据库里没有 RSI 列，或者值为 NaN，跳过
-                if 'RSI' not in row or pd.isna(row['RSI']): continue
-                
-                rsi = row['RSI']
+                # 1. 检查 RSI (超跌)，值为 NaN 跳过
+                rsi = data['RSI'][-1]
+                if np.isnan(rsi): continue
                 if rsi >= 30: continue # 只看 RSI < 30
                 
                 # 2. 检查 ATR% (高波动)
                 # ATR通常是绝对值，需要除以股价转为百分比
                 # 如果数据库没有 ATR，这里简单手算一下 ATR14 的近似值
-                if 'ATR' in row and pd.notna(row['ATR']):
-                    atr_val = row['ATR']
+                if 'ATR' in data and not np.isnan(data['ATR'][-1]):
+                    atr_val = data['ATR'][-1]
                 else:
-                    # 简易补救：计算最近14天的波动均值
-                    df['TR'] = df[['High', 'Close']].max(axis=1) - df[['Low', 'Close']].min(axis=1)
-                    atr_val = df['TR'].tail(14).mean()
+                    # 简易补救：计算最近14天的波动均值 (fmax/fmin/nanmean 跳过缺失值，与 pandas 行为一致)
+                    tr = np.fmax(data['High'], close) - np.fmin(data['Low'], close)
+                    atr_val = np.nanmean(tr[-14:])
                 
-                close_price = row['Close']
+                close_price = close[-1]
                 atr_pct = (atr_val / close_price) * 100
                 
                 # 核心条件：波动率必须大于 4% (说明股性活)
                 if atr_pct <= 4.0: continue
 
-                # ==========================================
-                # 🛑 第二道关卡：市值过滤 (联网查询，较慢)
-                # ==========================================
-                # 能走到这一步的股票已经很少了，所以这里联网查不耗时
-                print(f"   >>> 正在核验 {ticker} 市值...")
-                market_cap_亿 = self.get_realtime_market_cap(ticker)
-                
-                if market_cap_亿 < 200: 
-                    # print(f"       市值不足 ({market_cap_亿:.0f}亿), 剔除.")
-                    continue
-
-                # ==========================================
-                # ✅ 全部通关，加入结果
-                # ==========================================
-                results.append({
-                    'Ticker': ticker,
-                    'Close': close_price,
-                    'RSI': rsi,
-                    'ATR_Pct': atr_pct,
-                    'MarketCap': market_cap_亿,
-                    'Strategy': 'High Win Rate Dip',
-                    'Detail': f"RSI={rsi:.1f} (超跌) | ATR={atr_pct:.1f}% (活跃) | 市值={market_cap_亿:.0f}亿"
-                })
+                candidates.append((ticker, close_price, rsi, atr_pct))
 
             except Exception as e:
                 # print(f"Error {ticker}: {e}")
                 continue
 
+        if not candidates:
+            return []
+
+        # ==========================================
+        # 🛑 第二道关卡：市值过滤 (联网查询，较慢)
+        # ==========================================
+        # 能走到这一步的股票已经很少了，一次批量查询 (有缓存的直接读库)
+        print(f"   >>> 正在核验 {len(candidates)} 只候选股市值...")
+        market_caps = self.get_realtime_market_caps([c[0] for c in candidates])
+
+        for ticker, close_price, rsi, atr_pct in candidates:
+            market_cap_亿 = market_caps.get(ticker, 0)
+            
+            if market_cap_亿 < 200: 
+                # print(f"       市值不足 ({market_cap_亿:.0f}亿), 剔除.")
+                continue
+
+            # ==========================================
+            # ✅ 全部通关，加入结果
+            # ==========================================
+            results.append({
+                'Ticker': ticker,
+                'Close': close_price,
+                'RSI': rsi,
+                'ATR_Pct': atr_pct,
+                'MarketCap': market_cap_亿,
+                'Strategy': 'High Win Rate Dip',
+                'Detail': f"RSI={rsi:.1f} (超跌) | ATR={atr_pct:.1f}% (活跃) | 市值={market_cap_亿:.0f}亿"
+            })
+
         # 按 RSI 从低到高排序 (越低越超跌)
         return sorted(results, key=lambda x: x['RSI'])
\ No newline at end of file
@@ -1,17 +1,145 @@
 import pandas as pd
-import sqlite3
 import config
+import db
 import matplotlib.pyplot as plt
 import numpy as np
+import os
+from pathlib import Path
+from _njit import njit
+
+CACHE_DIR = ".cache"
+SNAPSHOT_PATH = os.path.join(CACHE_DIR, "reversal_market_data.pkl")
+# 快照里存的是算好信号列 (RSI_min5 / ma_cross / kdj_up) 的数据，改了 _query_market_data 的读法或派生列算法就把版本号加一，旧快照自动作废
+SNAPSHOT_VERSION = 1
+
+ACTION_BUY, ACTION_SELL = 0, 1
+SELL_REASONS = ["止损触少(-5%)", "保本离场", "跌破EMA5止盈"]
+
+@njit(cache=True)
+def _append_trade(log, n_log, day, t, action, reason, price, pnl):
+    """往交易记录数组追加一行，满了就扩容一倍，返回 (新数组, 新行数)"""
+    if n_log == len(log):
+        grown = np.empty((2 * len(log), 6))
+        grown[:n_log] = log
+        log = grown
+    log[n_log, 0] = day
+    log[n_log, 1] = t
+    log[n_log, 2] = action
+    log[n_log, 3] = reason
+    log[n_log, 4] = price
+    log[n_log, 5] = pnl
+    return log, n_log + 1
+
+@njit(cache=True)
+def _backtest_kernel(close, ema5, present, sig_ticks, sig_start, initial_capital, max_pos_pct, stop_loss_pct, start_day):
+    """
+    逐日回测的状态机 (numba 编译；没有 numba 时按普通 Python 运行，结果相同)
+    持仓用按股票下标的平行数组表示，order 记录买入先后 (市值累加、卖出检查都按这个顺序)
+    返回 (现金, 每日总资产, 交易记录, (qty, entry, last, max_pnl, 持仓顺序))
+    交易记录每行: 天下标, 股票下标, 动作 (ACTION_*), 卖出原因 (SELL_REASONS 下标), 价格, 收益率
+    """
+    n_days, n_tickers = close.shape
+    cash = float(initial_capital)
+    qty = np.zeros(n_tickers)
+    entry = np.zeros(n_tickers)
+    last = np.zeros(n_tickers)
+    max_pnl = np.zeros(n_tickers)
+    held = np.zeros(n_tickers, dtype=np.bool_)
+    order = np.empty(n_tickers, dtype=np.int64)
+    n_held = 0
+    equity = np.empty(max(n_days - start_day, 0))
+    log = np.empty((64, 6))
+    n_log = 0
+
+    for i in range(start_day, n_days):
+        daily_equity = cash
+
+        # --- 1. 持仓管理 (卖出逻辑) ---
+        snapshot = order[:n_held].copy()
+        for t in snapshot:
+            if not present[i, t]:
+                # 停牌时更新市值
+                daily_equity += qty[t] * last[t]
+                continue
+
+            price = close[i, t]
+            # 更新市值
+            daily_equity += qty[t] * price
+            last[t] = price
+
+            # 计算当前收益率
+            pnl_pct = (price - entry[t]) / entry[t]
+
+            reason = -1
+            if pnl_pct <= -stop_loss_pct:
+                # A. 止损 (Hard Stop): 亏损 5%
+                reason = 0
+            elif max_pnl[t] > 0.05 and pnl_pct < 0.01:
+                # B. 动态止盈策略：如果曾经盈利超过 5%，则止损线上移至 成本价 (保本)
+                reason = 1
+            elif not np.isnan(ema5[i, t]) and price < ema5[i, t] and pnl_pct > 0:
+                # 跌破 5日线 止盈 (短线战法核心)：只有当盈利状态下才卖出；亏损时由止损保护
+                reason = 2
+
+            if reason >= 0:
+                cash += qty[t] * price
+                log, n_log = _append_trade(log, n_log, i, t, ACTION_SELL, reason, price, (price - entry[t]) / entry[t])
+                held[t] = False
+                k = 0
+                for j in range(n_held):
+                    if order[j] != t:
+                        order[k] = order[j]
+                        k += 1
+                n_held = k
+            elif pnl_pct > max_pnl[t]:
+                # 更新持仓最高收益 (用于触发保本逻辑)
+                max_pnl[t] = pnl_pct
+
+        # --- 2. 开仓管理 (买入逻辑) ---
+        # 只有现金够买至少一只股票时才扫描
+        if cash > initial_capital * 0.05:
+            # 持仓市值 (按买入顺序累加) 每天只算一次；买入阶段价格不变，新仓位排在最后，买入后直接累加即可
+            pos_value = 0.0
+            for j in range(n_held):
+                pos_value += qty[order[j]] * last[order[j]]
+
+            for s in range(sig_start[i], sig_start[i + 1]):
+                t = sig_ticks[s]
+                if held[t]: continue
+                price = close[i, t]
+
+                # 仓位控制：不超过总资金的 20% (总资产 = 现金 + 持仓市值)
+                target_pos_value = (cash + pos_value) * max_pos_pct
+
+                # 实际买入金额 (不能超过现金)
+                invest_amt = target_pos_value if target_pos_value < cash else cash
+
+                if invest_amt > 500: # 最小交易额
+                    qty[t] = invest_amt / price
+                    cash -= invest_amt
+                    entry[t] = price
+                    last[t] = price
+                    max_pnl[t] = 0.0 # 记录最大浮盈
+                    held[t] = True
+                    order[n_held] = t
+                    n_held += 1
+                    pos_value += qty[t] * last[t]
+                    log, n_log = _append_trade(log, n_log, i, t, ACTION_BUY, -1, price, np.nan)
+
+        equity[i - start_day] = daily_equity
+
+    return cash, equity, log[:n_log], (qty, entry, last, max_pnl, order[:n_held])
 
 class ReversalStrategyBacktest:
     def __init__(self, initial_capital=100000):
-        self.conn = sqlite3.connect(config.DB_NAME)
+        self.conn = db.open_ro()
         self.cash = initial_capital
         self.initial_capital = initial_capital
         self.positions = {} 
-        self.trade_log = []
-        self.history_equity = []
+        # 交易记录按列存 (Date/Ticker/Action/Price/Reason/PnL)，净值曲线存成两个数组，report 里直接建 DataFrame
+        self.trade_log = {}
+        self._eq_dates = np.empty(0, dtype='datetime64[ns]')
+        self._eq_val = np.empty(0, dtype='f8')
         
         # 策略参数
         self.max_pos_pct = 0.20   # 最大仓位 20%
@@ -19,157 +147,163 @@ class ReversalStrategyBacktest:
 
     def load_data(self):
         print("⏳ 正在加载全市场数据...")
-        self.market_data = {}
-        all_dates = set()
-        
-        for ticker in config.WATCHLIST:
-            try:
-                # 必须按时间正序加载
-                table_name = f"stock_{ticker.replace('-', '_')}"
-                df = pd.read_sql(f"SELECT * FROM {table_name} ORDER BY Date ASC", self.conn, parse_dates=['Date'])
-                if not df.empty:
-                    df.set_index('Date', inplace=True)
-                    self.market_data[ticker] = df
-                    all_dates.update(df.index)
-            except: continue
-            
-        self.timeline = sorted(list(all_dates))
+        # 先列出库里已有的日线表，只查存在的表 (表里没有的列填 NULL)，不再逐只 try/except
+        table_cols = db.get_table_columns(self.conn)
+        targets = [(ticker, f"stock_{ticker.replace('-', '_')}") for ticker in dict.fromkeys(config.WATCHLIST)]
+        targets = [(ticker, table) for ticker, table in targets if 'Date' in table_cols.get(table, ())]
+
+        # 调参时反复回测，库没更新过就直接读上次落盘的快照，跳过 SQLite 查询和解析
+        self.market_data = self._load_snapshot(targets)
+        if self.market_data is None:
+            self.market_data = self._query_market_data(targets, table_cols)
+            self._save_snapshot(targets)
+
+        self.timeline = sorted(set().union(*(df.index for df in self.market_data.values())))
+        self._build_panel()
         print(f"✅ 数据加载完毕，共 {len(self.market_data)} 只股票")
 
+    def _query_market_data(self, targets, table_cols):
+        """从库里读取各股票日线并预先算好信号列，返回 {ticker: DataFrame}"""
+        market_data = {}
+        columns = ['Close', 'EMA5', 'EMA10', 'RSI', 'K', 'D']
+
+        # 一条 UNION ALL 查询读多只股票，按 WATCHLIST 顺序、时间正序排好 (SQLite 单条复合查询最多 500 个 SELECT，分批拼)
+        for start in range(0, len(targets), 500):
+            batch = targets[start:start + 500]
+            parts = []
+            for seq, (ticker, table) in enumerate(batch):
+                select_cols = ", ".join(f'"{c}"' if c in table_cols[table] else f'NULL AS "{c}"' for c in columns)
+                parts.append(f'SELECT {seq} AS _seq, Date, {select_cols} FROM "{table}"')
+            rows = self.conn.execute(" UNION ALL ".join(parts) + " ORDER BY _seq, Date ASC").fetchall()
+
+            # 游标直接拿元组建表，跳过 pd.read_sql 的封装层
+            df_all = pd.DataFrame.from_records(rows, columns=['_seq', 'Date'] + columns)
+            df_all['Date'] = pd.to_datetime(df_all['Date'], format='ISO8601')
+            df_all[columns] = df_all[columns].astype(float)
+
+            # 空表没有行，自然跳过
+            for seq, df in df_all.groupby('_seq', sort=False):
+                df = df.drop(columns=['_seq']).set_index('Date')
+                # 过去5天 (该股自己的5行数据) RSI 最低值，回测里判断“超卖”直接查这一列
+                df['RSI_min5'] = df['RSI'].rolling(5, min_periods=1).min()
+                # 5日线上穿10日线 (今天 5>10 且上一行 5<=10)、KDJ 金叉 (K>D)，预先算成布尔列 (缺列时为 NaN，比较结果为 False)
+                df['ma_cross'] = df['EMA5'].gt(df['EMA10']) & df['EMA5'].shift(1).le(df['EMA10'].shift(1))
+                df['kdj_up'] = df['K'].gt(df['D'])
+                market_data[batch[seq][0]] = df
+        return market_data
+
+    def _snapshot_key(self, targets):
+        """快照对应的数据格式版本 + 库文件 + 股票列表 (改了派生列、换库或改了 WATCHLIST 都要重读)"""
+        return SNAPSHOT_VERSION, str(Path(config.DB_NAME).resolve()), tuple(targets)
+
+    def _load_snapshot(self, targets):
+        """快照比库文件 (含 WAL 日志) 新且对应同一份股票列表时返回上次的 market_data，否则返回 None"""
+        if not os.path.exists(SNAPSHOT_PATH):
+            return None
+        if os.path.getmtime(SNAPSHOT_PATH) <= db.get_db_mtime():
+            return None
+        try:
+            snapshot = pd.read_pickle(SNAPSHOT_PATH)
+        except Exception:
+            return None
+        if snapshot.get('key') != self._snapshot_key(targets):
+            return None
+        print("⚡ 使用本地数据快照")
+        return snapshot['market_data']
+
+    def _save_snapshot(self, targets):
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        pd.to_pickle({'key': self._snapshot_key(targets), 'market_data': self.market_data}, SNAPSHOT_PATH)
+
+    def _build_panel(self):
+        """
+        把各股票的数据按 self.timeline 对齐成二维数组 (行: 交易日，列: 股票)，回测循环按整数下标取值
+        某天没有这只股票的数据 (停牌/未上市) 时 present 为 False，数值为 NaN；表里没有的列整列为 NaN
+        """
+        self.tickers = list(self.market_data)
+        self.ticker_idx = {ticker: t for t, ticker in enumerate(self.tickers)}
+        n_days = len(self.timeline)
+
+        def panel(col):
+            arrays = [df[col].reindex(self.timeline).to_numpy(dtype=float) if col in df.columns else np.full(n_days, np.nan)
+                      for df in self.market_data.values()]
+            return np.column_stack(arrays) if arrays else np.empty((n_days, 0))
+
+        def mask(col):
+            arrays = [df[col].reindex(self.timeline, fill_value=False).to_numpy(dtype=bool) if col in df.columns else np.zeros(n_days, dtype=bool)
+                      for df in self.market_data.values()]
+            return np.column_stack(arrays) if arrays else np.empty((n_days, 0), dtype=bool)
+
+        self.close = panel('Close')
+        self.ema5 = panel('EMA5')
+        self.ema10 = panel('EMA10')
+        self.rsi = panel('RSI')
+        self.rsi_min5 = panel('RSI_min5')
+        self.k = panel('K')
+        self.d = panel('D')
+        self.ma_cross = mask('ma_cross')
+        self.kdj_up = mask('kdj_up')
+        presents = [pd.Index(self.timeline).isin(df.index) for df in self.market_data.values()]
+        self.present = np.column_stack(presents) if presents else np.empty((n_days, 0), dtype=bool)
+
     def run(self):
         self.load_data()
         print("🚀 开始回测策略: [5/10日金叉 + RSI超卖 + KDJ金叉]...")
-        
-        for i, date in enumerate(self.timeline):
-            # 必须从第2天开始(需要比较昨天)
-            if i < 5: continue 
-            
-            prev_date = self.timeline[i-1]
-            daily_equity = self.cash
-            
-            # --- 1. 持仓管理 (卖出逻辑) ---
-            for ticker in list(self.positions.keys()):
-                df = self.market_data.get(ticker)
-                if date not in df.index: 
-                    # 停牌时更新市值
-                    daily_equity += self.positions[ticker]['qty'] * self.positions[ticker]['last_price']
-                    continue
-                
-                row = df.loc[date]
-                pos = self.positions[ticker]
-                price = row['Close']
-                
-                # 更新市值
-                daily_equity += pos['qty'] * price
-                self.positions[ticker]['last_price'] = price
-                
-                # 计算当前收益率
-                pnl_pct = (price - pos['entry_price']) / pos['entry_price']
-                
-                # A. 止损 (Hard Stop): 亏损 5%
-                if pnl_pct <= -self.stop_loss_pct:
-                    self._sell(date, ticker, price, f"止损触少(-5%)")
-                    continue
-                
-                # B. 动态止盈策略
-                # 逻辑：如果曾经盈利超过 5%，则止损线上移至 成本价 (保本)
-                if pos['max_pnl'] > 0.05 and pnl_pct < 0.01:
-                    self._sell(date, ticker, price, "保本离场")
-                    continue
-                    
-                # 逻辑：跌破 5日线 止盈 (短线战法核心)
-                # 只有当盈利状态下，跌破5日线才卖出；亏损时由止损保护
-                if pd.notna(row.get('EMA5')) and price < row['EMA5'] and pnl_pct > 0:
-                     self._sell(date, ticker, price, "跌破EMA5止盈")
-                     continue
 
-                # 更新持仓最高收益 (用于触发保本逻辑)
-                if pnl_pct > pos['max_pnl']:
-                    self.positions[ticker]['max_pnl'] = pnl_pct
-
-            # --- 2. 开仓管理 (买入逻辑) ---
-            # 只有现金够买至少一只股票时才扫描
-            if self.cash > self.initial_capital * 0.05:
-                for ticker in self.market_data:
-                    if ticker in self.positions: continue
-                    
-                    df = self.market_data.get(ticker)
-                    if date not in df.index or prev_date not in df.index: continue
-                    
-                    curr = df.loc[date]
-                    prev = df.loc[prev_date]
-                    
-                    # 确保所有指标都存在
-                    if pd.isna(curr.get('EMA5')) or pd.isna(curr.get('EMA10')) or \
-                       pd.isna(curr.get('RSI')) or pd.isna(curr.get('K')) or pd.isna(curr.get('D')):
-                        continue
-
-                    # === 核心策略逻辑 ===
-                    
-                    # 条件1: 股价5日线上穿10日线 (金叉)
-                    # 判定：今天 5>10 且 昨天 5<=10
-                    ma_cross = (curr['EMA5'] > curr['EMA10']) and (prev['EMA5'] <= prev['EMA10'])
-                    
-                    # 条件2: RSI出现超卖
-                    # 注意：通常MA金叉时价格已经涨起来了，RSI可能已经回到40-50了
-                    # 所以我们判定：过去5天内，RSI曾经低于 35
-                    # 获取过去5天数据
-                    recent_rsi = df.loc[:date].tail(5)['RSI']
-                    rsi_oversold = (recent_rsi < 35).any()
-                    
-                    # 条件3: KDJ出现反转 (金叉)
-                    # 判定：今天 K > D (或者 J 向上拐头)
-                    kdj_up = (curr['K'] > curr['D'])
-                    
-                    if ma_cross and rsi_oversold and kdj_up:
-                        self._buy(date, ticker, curr['Close'])
-
-            self.history_equity.append({'Date': date, 'Total_Equity': daily_equity})
-
-    def _buy(self, date, ticker, price):
-        # 仓位控制：不超过总资金的 20%
-        # 计算当前总资产 (现金 + 持仓市值)
-        total_asset = self.cash + sum(p['qty'] * p['last_price'] for p in self.positions.values())
-        
-        target_pos_value = total_asset * self.max_pos_pct
-        
-        # 实际买入金额 (不能超过现金)
-        invest_amt = min(self.cash, target_pos_value)
-        
-        if invest_amt > 500: # 最小交易额
-            qty = invest_amt / price
-            self.cash -= invest_amt
-            self.positions[ticker] = {
-                'qty': qty,
-                'entry_price': price,
-                'last_price': price,
-                'max_pnl': 0 # 记录最大浮盈
-            }
-            self.trade_log.append({
-                'Date': date, 'Ticker': ticker, 'Action': 'BUY', 
-                'Price': price, 'Reason': 'MA5/10金叉+RSI超卖'
-            })
-
-    def _sell(self, date, ticker, price, reason):
-        pos = self.positions[ticker]
-        market_val = pos['qty'] * price
-        self.cash += market_val
-        pnl = (price - pos['entry_price']) / pos['entry_price']
-        
-        self.trade_log.append({
-            'Date': date, 'Ticker': ticker, 'Action': 'SELL', 
-            'Price': price, 'Reason': reason, 'PnL': pnl
-        })
-        del self.positions[ticker]
+        # === 买入信号：整张面板一次向量化算完 (NaN 参与比较结果为 False) ===
+        # 今天和昨天都要有数据，且今天所有指标都存在
+        valid = self.present.copy()
+        valid[1:] &= self.present[:-1]
+        for arr in (self.ema5, self.ema10, self.rsi, self.k, self.d):
+            valid &= ~np.isnan(arr)
+
+        # 条件1: 股价5日线上穿10日线 (金叉)
+        # 判定：今天 5>10 且 昨天 5<=10 (load_data 里预先算好的 ma_cross；昨天必须有数据，上一行就是昨天)
+        # 条件2: RSI出现超卖
+        # 注意：通常MA金叉时价格已经涨起来了，RSI可能已经回到40-50了
+        # 所以我们判定：过去5天内，RSI曾经低于 35 (load_data 里预先算好的 RSI_min5)
+        # 条件3: KDJ出现反转 (金叉)
+        # 判定：今天 K > D (或者 J 向上拐头)
+        signal = valid & self.ma_cross & (self.rsi_min5 < 35) & self.kdj_up
+
+        # 每天命中的股票下标 (按天排好)，sig_start[i]:sig_start[i+1] 是第 i 天的
+        sig_days, sig_ticks = np.nonzero(signal)
+        sig_start = np.searchsorted(sig_days, np.arange(len(self.timeline) + 1))
+
+        # 必须从第2天开始(需要比较昨天)，前 5 天不交易
+        self.cash, equity, log, (qty, entry, last, max_pnl, order) = _backtest_kernel(
+            self.close, self.ema5, self.present, sig_ticks, sig_start,
+            self.initial_capital, self.max_pos_pct, self.stop_loss_pct, 5
+        )
+
+        # 把编译循环的结果按列摊开 (日期/净值直接是数组，交易记录是几列平行数组)
+        self._eq_dates = np.asarray(self.timeline[5:], dtype='datetime64[ns]')
+        self._eq_val = equity
+        days, ticks = log[:, 0].astype(np.int64), log[:, 1].astype(np.int64)
+        is_buy = log[:, 2] == ACTION_BUY
+        self.trade_log = {
+            'Date': np.asarray(self.timeline, dtype='datetime64[ns]')[days],
+            'Ticker': np.asarray(self.tickers, dtype=object)[ticks],
+            'Action': np.where(is_buy, 'BUY', 'SELL').astype(object),
+            'Price': log[:, 4],
+            'Reason': np.where(is_buy, 'MA5/10金叉+RSI超卖',
+                               np.asarray(SELL_REASONS, dtype=object)[log[:, 3].astype(np.int64)]).astype(object),
+            'PnL': log[:, 5],
+        }
+        self.positions = {
+            self.tickers[t]: {'qty': qty[t], 'entry_price': entry[t], 'last_price': last[t], 'max_pnl': max_pnl[t]}
+            for t in order
+        }
 
     def report(self):
-        df_eq = pd.DataFrame(self.history_equity).set_index('Date')
-        final_ret = (df_eq['Total_Equity'].iloc[-1] / self.initial_capital) - 1
+        eq = self._eq_val
+        final_ret = (eq[-1] / self.initial_capital) - 1
         
-        # 计算回撤
-        df_eq['Peak'] = df_eq['Total_Equity'].cummax()
-        df_eq['Drawdown'] = (df_eq['Total_Equity'] - df_eq['Peak']) / df_eq['Peak']
-        max_dd = df_eq['Drawdown'].min()
+        # 计算回撤 (直接在净值数组上累计最大值；fmax/nanmin 跳过 NaN，和 pandas 的 cummax/min 一致)
+        peak = np.fmax.accumulate(eq)
+        dd = (eq - peak) / peak
+        max_dd = np.nanmin(dd)
+        df_eq = pd.DataFrame({'Total_Equity': eq, 'Drawdown': dd}, index=pd.DatetimeIndex(self._eq_dates, name='Date'))
 
         print("\n" + "="*40)
         print(f"📊 策略回测报告 (Reversal Strategy)")
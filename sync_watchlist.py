@@ -3,6 +3,11 @@ import config
 import re
 import os
 import json
+from pathlib import Path
+
+# 匹配模式：WATCHLIST = [ ... ] (支持多行)
+# re.DOTALL 让 . 能够匹配换行符；模块加载时编译一次
+_WATCHLIST_RE = re.compile(r"WATCHLIST\s*=\s*\[.*?\]", re.DOTALL)
 
 def update_config_watchlist(csv_path):
     """
@@ -38,14 +43,12 @@ def update_config_watchlist(csv_path):
 
     print(f"🆕 发现 {len(diff)} 只新股票: {diff}")
     
-    # 合并并排序 (保持列表整洁)
-    final_list = sorted(list(current_watchlist.union(new_tickers)))
+    # 合并并排序 (保持列表整洁)；sorted 直接吃集合，不再先转一遍 list
+    final_list = sorted(current_watchlist | new_tickers)
 
     # 4. 原地修改 config.py 文件
-    config_path = "config.py"
-    
-    with open(config_path, 'r', encoding='utf-8') as f:
-        content = f.read()
+    config_path = Path("config.py")
+    content = config_path.read_text(encoding='utf-8')
 
     # 使用 json.dumps 将列表转换为格式化的字符串
     # ensure_ascii=False 允许中文注释(虽然这里是股票代码)
@@ -56,16 +59,13 @@ def update_config_watchlist(csv_path):
     new_block = f"WATCHLIST = {list_str}"
 
     # === 正则替换 ===
-    # 匹配模式：WATCHLIST = [ ... ] (支持多行)
-    # re.DOTALL 让 . 能够匹配换行符
-    pattern = r"WATCHLIST\s*=\s*\[.*?\]"
+    # 一次 subn 完成查找+替换，只替换第一处；替换内容用函数返回，不做反斜杠转义处理
+    new_content, n = _WATCHLIST_RE.subn(lambda m: new_block, content, count=1)
     
-    if re.search(pattern, content, re.DOTALL):
-        new_content = re.sub(pattern, new_block, content, flags=re.DOTALL)
-        
-        # 写入文件
-        with open(config_path, 'w', encoding='utf-8') as f:
-            f.write(new_content)
+    if n:
+        # 内容有变化才写入文件
+        if new_content != content:
+            config_path.write_text(new_content, encoding='utf-8')
             
         print(f"🚀 已成功将 {len(diff)} 只新股票写入 {config_path}！")
         print(f"📊 当前监控总数: {len(final_list)}")
@@ -1,9 +1,9 @@
 import pandas as pd
-import sqlite3
+import numpy as np
 import pytz
 import os
 from datetime import datetime, timedelta
-import config  
+import db
 from data_engine import StockDataEngine 
 
 # 结果保存路径
@@ -12,24 +12,30 @@ OUTPUT_FILE = "交易复盘_全量报告.csv"
 class TradeReviewer:
     def __init__(self, csv_path):
         self.csv_path = csv_path
-        self.conn = sqlite3.connect(config.DB_NAME)
+        # 会顺带给老表补建索引，用写连接 (WAL + 大页缓存)；所有分钟线查询共用一个游标
+        self.conn = db.open_rw()
+        self.cursor = self.conn.cursor()
         self.tz_cn = pytz.timezone('Asia/Shanghai')
         self.tz_us = pytz.timezone('America/New_York')
         
         # 设定脏数据过滤阈值 (20%)
         self.bad_tick_threshold = 0.20
 
-    def _convert_time(self, time_str):
-        try:
-            dt_cn = datetime.strptime(time_str, "%Y/%m/%d %H:%M")
-            dt_cn = self.tz_cn.localize(dt_cn)
-            dt_us = dt_cn.astimezone(self.tz_us)
-            return dt_us
-        except:
-            return None
+        # 分钟线缓存: (表名, 日期) -> 当天行情 (清洗前)，同一只股票同一天的多笔交易只读一次库
+        self._kline_cache = {}
+        self._indexed_tables = set()
+        # 库里已有的分钟线表，一次查出来做集合判断，不再每笔交易查 sqlite_master
+        self._known_tables = self._list_minute_tables()
 
-    def _generate_fingerprint(self, row):
-        return f"{row['交易标的']}_{row['交易方向']}_{row['交易价格']}_{row['交易时间']}"
+    def _convert_times(self, time_series):
+        """北京时间字符串列 ("%Y/%m/%d %H:%M") -> 美东时间 (解析失败为 NaT)"""
+        dt_cn = pd.to_datetime(time_series, format="%Y/%m/%d %H:%M", errors='coerce')
+        return dt_cn.dt.tz_localize(self.tz_cn).dt.tz_convert(self.tz_us)
+
+    def _generate_fingerprints(self, df):
+        """整列生成交易指纹: 标的_方向_价格_时间 (逐个 str()，与原先 f-string 拼出来的一致)"""
+        cols = [df[c].map(str) for c in ['交易标的', '交易方向', '交易价格', '交易时间']]
+        return cols[0] + '_' + cols[1] + '_' + cols[2] + '_' + cols[3]
 
     def get_processed_fingerprints(self):
         if not os.path.exists(OUTPUT_FILE):
@@ -67,22 +73,15 @@ class TradeReviewer:
 
         # === 增量筛选：剔除已分析过的 & 太久远的 ===
         processed_fingerprints = self.get_processed_fingerprints()
-        new_trades = []
-        
-        for index, row in self.df_trades.iterrows():
-            # 1. 时间筛选：只看固定日期之后的
-            dt_us = self._convert_time(row['交易时间'])
-            if not dt_us or dt_us < cutoff_time:
-                continue 
-            
-            # 2. 指纹筛选：只看没分析过的
-            fp = self._generate_fingerprint(row)
-            if fp not in processed_fingerprints:
-                row['指纹'] = fp
-                row['dt_us'] = dt_us 
-                new_trades.append(row)
+
+        # 交易时间整列一次转成美东时间 (格式不对的为 NaT)，指纹整列拼好
+        self.df_trades['dt_us'] = self._convert_times(self.df_trades['交易时间'])
+        self.df_trades['指纹'] = self._generate_fingerprints(self.df_trades)
         
-        self.df_new = pd.DataFrame(new_trades)
+        # 1. 时间筛选：只看固定日期之后的 (NaT 比较结果为 False，一并剔除)
+        # 2. 指纹筛选：只看没分析过的
+        mask = (self.df_trades['dt_us'] >= cutoff_time) & ~self.df_trades['指纹'].isin(processed_fingerprints)
+        self.df_new = self.df_trades[mask].copy()
         
         if self.df_new.empty:
             print("✅ 无新增交易，指定日期后的交易均已复盘。")
@@ -105,6 +104,8 @@ class TradeReviewer:
             engine = StockDataEngine()
             engine.update_minute_data(target_tickers=list(tickers_to_sync))
             engine.close()
+            self._kline_cache.clear() # 分钟线更新过，旧缓存作废
+            self._known_tables = self._list_minute_tables() # 可能新建了表
 
     def analyze(self):
         if not hasattr(self, 'df_new') or self.df_new.empty:
@@ -122,33 +123,22 @@ class TradeReviewer:
             table_name = f"stock_2m_{ticker.replace('-', '_')}"
             try:
                 # 1. 检查表
-                check_cursor = self.conn.cursor()
-                check_cursor.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{table_name}'")
-                if not check_cursor.fetchone():
+                if table_name not in self._known_tables:
                     results.append(self._make_result(row, dt_us, "无历史数据", 0, 0, None, None, None))
                     continue
 
                 # 2. 只查当天
                 trade_date_str = dt_us.strftime('%Y-%m-%d')
-                query = f"""
-                    SELECT * FROM {table_name} 
-                    WHERE substr(Datetime, 1, 10) = '{trade_date_str}'
-                """
-                df_kline = pd.read_sql(query, self.conn, parse_dates=['Datetime'])
+                times, lows, highs = self._load_day_kline(table_name, trade_date_str)
                 
-                if df_kline.empty:
+                if len(times) == 0:
                     results.append(self._make_result(row, dt_us, "数据缺失", 0, 0, None, None, None))
                     continue
-                
-                if df_kline['Datetime'].dt.tz is None:
-                     df_kline['Datetime'] = df_kline['Datetime'].dt.tz_localize(self.tz_us)
-                else:
-                     df_kline['Datetime'] = df_kline['Datetime'].dt.tz_convert(self.tz_us)
 
-                # 3. 筛选后续行情
-                df_future = df_kline[df_kline['Datetime'] > dt_us]
+                # 3. 筛选后续行情 (布尔掩码，保持表里的原始顺序；统一按 UTC 的 datetime64 比较)
+                future = times > np.datetime64(dt_us.value, 'ns')
                 
-                if df_future.empty:
+                if not future.any():
                     results.append(self._make_result(row, dt_us, "无后续行情(尾盘)", 0, 0, None, None, None))
                     continue
 
@@ -156,16 +146,13 @@ class TradeReviewer:
                 lower_bound = exec_price * (1 - self.bad_tick_threshold)
                 upper_bound = exec_price * (1 + self.bad_tick_threshold)
 
-                df_future = df_future[
-                    (df_future['Low'] > lower_bound) & 
-                    (df_future['High'] < upper_bound)
-                ]
+                idx = np.flatnonzero(future & (lows > lower_bound) & (highs < upper_bound))
 
-                if df_future.empty:
+                if len(idx) == 0:
                     results.append(self._make_result(row, dt_us, "数据异常(已清洗)", 0, 0, None, None, None))
                     continue
 
-                # 5. 寻找最优
+                # 5. 寻找最优 (清洗后不含 NaN；argmin/argmax 与第一个更优价都取最早出现的一根)
                 better_price_found = False
                 best_price = exec_price
                 diff = 0
@@ -173,26 +160,26 @@ class TradeReviewer:
                 first_better_time = None
                 
                 if action == 'B':
-                    min_price = df_future['Low'].min()
+                    future_lows = lows[idx]
+                    best = future_lows.argmin()
+                    min_price = future_lows[best]
                     if min_price < exec_price:
                         better_price_found = True
                         best_price = min_price
                         diff = exec_price - min_price
-                        best_time = df_future.loc[df_future['Low'].idxmin()]['Datetime']
-                        better_rows = df_future[df_future['Low'] < exec_price]
-                        if not better_rows.empty:
-                            first_better_time = better_rows.iloc[0]['Datetime']
+                        best_time = pd.Timestamp(times[idx[best]], tz='UTC')
+                        first_better_time = pd.Timestamp(times[idx[np.argmax(future_lows < exec_price)]], tz='UTC')
 
                 elif action == 'S':
-                    max_price = df_future['High'].max()
+                    future_highs = highs[idx]
+                    best = future_highs.argmax()
+                    max_price = future_highs[best]
                     if max_price > exec_price:
                         better_price_found = True
                         best_price = max_price
                         diff = max_price - exec_price
-                        best_time = df_future.loc[df_future['High'].idxmax()]['Datetime']
-                        better_rows = df_future[df_future['High'] > exec_price]
-                        if not better_rows.empty:
-                            first_better_time = better_rows.iloc[0]['Datetime']
+                        best_time = pd.Timestamp(times[idx[best]], tz='UTC')
+                        first_better_time = pd.Timestamp(times[idx[np.argmax(future_highs > exec_price)]], tz='UTC')
 
                 status = "❌ 过早行动" if better_price_found else "✅ 完美操作"
                 pct = (diff / exec_price * 100) if better_price_found else 0
@@ -205,48 +192,97 @@ class TradeReviewer:
             except Exception as e:
                 results.append(self._make_result(row, dt_us, f"错误: {str(e)}", 0, 0, None, None, None))
 
-        return pd.DataFrame(results)
+        return self._format_results(results)
 
-    def _calculate_duration(self, start_time, end_time):
-        if not start_time or not end_time: return "-"
-        delta_seconds = (end_time - start_time).total_seconds()
-        if delta_seconds <= 0: return "+0m"
-        hours, remainder = divmod(delta_seconds, 3600)
-        minutes, _ = divmod(remainder, 60)
-        return f"+{int(hours)}h {int(minutes)}m" if hours > 0 else f"+{int(minutes)}m"
+    def _list_minute_tables(self):
+        """库里已有的分钟线表名集合"""
+        return {name for (name,) in self.conn.execute(
+            "SELECT name FROM sqlite_master WHERE type='table' AND name LIKE 'stock_2m_%'"
+        )}
+
+    def _load_day_kline(self, table_name, trade_date_str):
+        """
+        读取某只股票某一天的 2m 分钟线，返回 (UTC datetime64 数组, Low 数组, High 数组)
+        按文本区间 [当天, 次日) 过滤 (等价于日期前缀匹配)，日期走参数绑定，能用上 Datetime 索引/主键做范围扫描
+        结果按 (表名, 日期) 缓存；脏数据清洗依赖每笔交易的成交价，留给调用方做
+        """
+        key = (table_name, trade_date_str)
+        if key not in self._kline_cache:
+            if table_name not in self._indexed_tables:
+                db.ensure_datetime_index(self.conn, table_name) # 老表没有 Datetime 索引的顺带补建
+                self._indexed_tables.add(table_name)
+            self._kline_cache[key] = self._query_day_kline(table_name, trade_date_str)
+        return self._kline_cache[key]
+
+    def _query_day_kline(self, table_name, trade_date_str):
+        """查库读取当天分钟线，时间统一成 UTC 的 datetime64 数组 (不经过缓存)"""
+        next_date_str = (datetime.strptime(trade_date_str, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+        query = f"""
+            SELECT Datetime, Low, High FROM "{table_name}" 
+            WHERE Datetime >= ? AND Datetime < ?
+        """
+        rows = self.cursor.execute(query, (trade_date_str, next_date_str)).fetchall()
+        df_kline = pd.DataFrame.from_records(rows, columns=['Datetime', 'Low', 'High'])
+        df_kline['Datetime'] = pd.to_datetime(df_kline['Datetime'])
+
+        if df_kline.empty:
+            return np.empty(0, dtype='datetime64[ns]'), np.empty(0), np.empty(0)
+        if df_kline['Datetime'].dt.tz is None:
+             df_kline['Datetime'] = df_kline['Datetime'].dt.tz_localize(self.tz_us)
+
+        times = df_kline['Datetime'].dt.tz_convert('UTC').dt.tz_localize(None).to_numpy(dtype='datetime64[ns]')
+        return times, df_kline['Low'].to_numpy(dtype=float), df_kline['High'].to_numpy(dtype=float)
 
     def _make_result(self, row, dt_us, status, best_price, diff_pct, best_time, trade_time, first_better_time):
-        res = {
-            '日期': dt_us.strftime('%m-%d') if dt_us else row['交易时间'][:10],
+        """只记录原始的时间/价格，字符串格式化留给 _format_results 整列处理"""
+        has_best = bool(best_time and trade_time)
+        return {
+            'dt_us': dt_us,
             '标的': row['交易标的'],
             '方向': row['交易方向'],
             '实际成交': row['交易价格'],
-            '实际时间': dt_us.strftime('%H:%M') if dt_us else "-",
-            '指纹': row['指纹'] 
+            '指纹': row['指纹'],
+            'best_time': best_time if has_best else None,
+            'first_better_time': first_better_time if has_best else None,
+            'best_price': best_price,
+            'diff_pct': diff_pct,
+            '评估': status,
+            '原始时间': row['交易时间'],
         }
 
-        if best_time and trade_time:
-            wait_for_best = self._calculate_duration(trade_time, best_time)
-            wait_for_first = self._calculate_duration(trade_time, first_better_time) if first_better_time else "-"
-            
-            res.update({
-                '最短等待': wait_for_first,
-                '最短等待时间点': first_better_time.strftime('%H:%M') if first_better_time else "-",
-                '最佳等待': wait_for_best,
-                '最优时间点': best_time.strftime('%H:%M'),
-                '最优价格': round(best_price, 2),
-                '错失空间%': round(diff_pct, 2),
-            })
-        else:
-            res.update({
-                '最短等待': "-", '最短等待时间点': "-",
-                '最佳等待': "-", '最优时间点': "-",
-                '最优价格': "-", '错失空间%': 0,
-            })
-
-        res['评估'] = status
-        res['原始时间'] = row['交易时间']
-        return res
+    def _format_durations(self, start, end):
+        """整列计算等待时长: '+Xh Ym' / '+Ym'，不到 0 记 '+0m'，缺失记 '-'"""
+        seconds = (end - start).dt.total_seconds()
+        clipped = seconds.fillna(0).clip(lower=0)
+        hours = (clipped // 3600).astype(int)
+        minutes = (clipped % 3600 // 60).astype(int)
+        text = ('+' + minutes.astype(str) + 'm').where(hours <= 0, '+' + hours.astype(str) + 'h ' + minutes.astype(str) + 'm')
+        return text.where(seconds.notna(), "-")
+
+    def _format_results(self, results):
+        """把 analyze 攒下的原始结果一次性格式化成输出表 (列顺序与 CSV 保持一致)"""
+        raw = pd.DataFrame(results)
+        dt_us = raw['dt_us']
+        best_time = pd.to_datetime(raw['best_time'], utc=True).dt.tz_convert(self.tz_us)
+        first_time = pd.to_datetime(raw['first_better_time'], utc=True).dt.tz_convert(self.tz_us)
+        has_best = best_time.notna()
+
+        return pd.DataFrame({
+            '日期': dt_us.dt.strftime('%m-%d'),
+            '标的': raw['标的'],
+            '方向': raw['方向'],
+            '实际成交': raw['实际成交'],
+            '实际时间': dt_us.dt.strftime('%H:%M'),
+            '指纹': raw['指纹'],
+            '最短等待': self._format_durations(dt_us, first_time),
+            '最短等待时间点': first_time.dt.strftime('%H:%M').fillna("-"),
+            '最佳等待': self._format_durations(dt_us, best_time),
+            '最优时间点': best_time.dt.strftime('%H:%M').fillna("-"),
+            '最优价格': raw['best_price'].round(2).where(has_best, "-"),
+            '错失空间%': raw['diff_pct'].round(2).where(has_best, 0),
+            '评估': raw['评估'],
+            '原始时间': raw['原始时间'],
+        })
     
     def close(self):
         self.conn.close()